@@ -2,12 +2,20 @@ import os
 import time
 import threading
 import shutil
-from flask import Flask, request, url_for, redirect, send_from_directory
+import json
+import hashlib
+from zoneinfo import ZoneInfo
+from datetime import datetime
+from flask import Flask, Response, request, url_for, redirect, send_from_directory, jsonify
 from flask_basicauth import BasicAuth
 from tableGenerator import TableGenerator
 from locoHandler import LocoListHandler
 from dumper import IsorDumper
+from isorParser import RouteResult
 from isorClient import IsorClient
+from refreshScheduler import RefreshScheduler
+from historyStore import HistoryStore
+from fleetIndex import FleetQuery
 
 app = Flask(__name__)  
 
@@ -22,6 +30,10 @@ os.environ['ISOR_DATA_COLORS_PATH'] = "data/lokomotivy.json"
 os.environ['ISOR_DATA_LAKY_CSS_PATH'] = "data/laky.css"
 os.environ['ISOR_BASIC_AUTH_USERNAME'] = 'clientUsername'
 os.environ['ISOR_BASIC_AUTH_PASSWORD'] = 'clientPassword'
+os.environ.setdefault('ISOR_BASE_URL', "https://isor.spravazeleznic.cz") ## point to fakeIsorServer.py for offline runs
+os.environ.setdefault('ISOR_REFRESH_BUDGET', "0") ## background refresh requests per hour, off unless set
+os.environ.setdefault('ISOR_DATA_HISTORY_PATH', "data/history.sqlite")
+os.environ.setdefault('ISOR_HISTORY_RETENTION_DAYS', "90")
 dataLakyMigrateToPath = "static/laky.css"
 
 ## Azure WebAPP environment variables
@@ -32,6 +44,10 @@ dataOutputPath = os.environ['ISOR_DATA_OUTPUT_PATH']
 dataColorsPath = os.environ['ISOR_DATA_COLORS_PATH']
 dataLakyMigrateFromPath = os.environ['ISOR_DATA_LAKY_CSS_PATH']
 dataLakyMigrateToPath = "static/laky.css"
+baseUrl = os.environ['ISOR_BASE_URL']
+refreshBudget = float(os.environ['ISOR_REFRESH_BUDGET'])
+dataHistoryPath = os.environ['ISOR_DATA_HISTORY_PATH']
+historyRetentionDays = float(os.environ['ISOR_HISTORY_RETENTION_DAYS'])
 app.config['BASIC_AUTH_USERNAME'] = os.environ['ISOR_BASIC_AUTH_USERNAME']
 app.config['BASIC_AUTH_PASSWORD'] = os.environ['ISOR_BASIC_AUTH_PASSWORD']
 
@@ -43,14 +59,20 @@ if (os.path.exists(dataLakyMigrateFromPath)):
     shutil.copyfile(dataLakyMigrateFromPath, dataLakyMigrateToPath)
 
 app.logger.info("Creating the IsorClient, IsorDumper, TableGenerator and LocoListHandler...")
-isorClient = IsorClient(app.logger, username, password)
-isorDumper = IsorDumper(app.logger, isorClient)
+isorClient = IsorClient(app.logger, username, password, baseUrl=baseUrl)
+historyStore = HistoryStore(dataHistoryPath, app.logger, retentionDays=historyRetentionDays)
+isorDumper = IsorDumper(app.logger, isorClient, historyStore=historyStore)
 tableGenerator = TableGenerator(dataOutputPath)
 locoHandler = LocoListHandler(dataConfigPath, dataColorsPath, app.logger)
+refreshScheduler = RefreshScheduler(app.logger, locoHandler, isorDumper, tableGenerator, refreshBudget)
 
 app.logger.info("Starting the IsorClient request handler...")
 threading.Thread(target=isorClient.RequestHandler).start()
 
+if refreshBudget > 0:
+    app.logger.info("Starting the refresh scheduler...")
+    threading.Thread(target=refreshScheduler.Run, daemon=True).start()
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'), 'favicon.ico', mimetype='image/vnd.microsoft.icon')
@@ -61,19 +83,18 @@ def index():
 
         app.logger.info("[GET] Loading the index page...")
 
-        timeWaitingForLock = time.time()
-        while tableGenerator.outputLock and time.time() - timeWaitingForLock < 10:
-            time.sleep(0.1)
-
-        if time.time() - timeWaitingForLock >= 10:
-            app.logger.debug("Timeout while waiting for the index page to be written")
-            raise Exception("Timeout while waiting for the index page to be written")
+        ## a filtered, sorted or paged view is rendered from the indexes, only its rows are sent
+        if FleetQuery.isRequested(request.args):
+            return tableGenerator.getFilteredIndexTable(FleetQuery.fromArgs(request.args))
 
-        html = open(dataOutputPath, "r", encoding="utf-8").read()
+        ## the last published snapshot, a refresh publishing meanwhile does not block us
+        snapshot = tableGenerator.outputSnapshot.current()
+        if snapshot is None:
+            return "Přehled zatím nebyl vygenerován"
 
-        app.logger.debug("Index page read")
+        app.logger.debug("Serving the index page snapshot")
 
-        return html
+        return snapshotResponse(snapshot)
     
     elif request.method == 'POST':
 
@@ -146,6 +167,8 @@ def get(loco_id):
         return "No such locomotive"
     
     app.logger.debug(f"Locomotive {loco_id} found")
+
+    refreshScheduler.bump(loco.fullNumber)
     
     ## when freshly loading
     if request.method == 'GET':
@@ -175,7 +198,7 @@ def get(loco_id):
 
             app.logger.info(f"[POST] Loading locomotive {loco_id}...")
 
-            res = isorDumper.dumpSingleLocomotive(loco)
+            res = isorDumper.dumpSingleLocomotive(loco, forceRefresh=True)
 
             app.logger.debug(f"Locomotive {loco_id} dumped")
 
@@ -237,7 +260,7 @@ def getTrain(train_id):
 
             app.logger.debug(f"Generating the table for train {train_id}...")
 
-            return tableGenerator.getRouteTable(res, isorDumper.singleQueryRequestDelay)
+            return snapshotResponse(getRouteSnapshot(train_id, res))
         else:
 
             app.logger.debug(f"Too many requests, remaining: {isorDumper.singleQueryRequestDelay - int(time.time() - isorDumper.lastRequest_singleQuery)} seconds")
@@ -251,7 +274,7 @@ def getTrain(train_id):
 
             app.logger.debug(f"Dumping train {train_id}...")
 
-            res = isorDumper.dumpTrainPost(train_id)
+            res = isorDumper.dumpTrainPost(train_id, forceRefresh=True)
 
             app.logger.debug(f"Train {train_id} dumped")
 
@@ -259,7 +282,7 @@ def getTrain(train_id):
 
                 app.logger.debug(f"Generating the table for train {train_id}...")
 
-                return tableGenerator.getRouteTable(res, isorDumper.singleQueryRequestDelay) 
+                return snapshotResponse(getRouteSnapshot(train_id, res))
             else:
 
                 app.logger.debug(f"Too many requests, remaining: {isorDumper.singleQueryRequestDelay - int(time.time() - isorDumper.lastRequest_singleQuery)} seconds")
@@ -293,6 +316,116 @@ def getTrain(train_id):
     
                 return redirect(url_for("getTrain", train_id=trainNum))
     
+@app.route('/get/train/<train_id>/json')
+@basic_auth.required
+def getTrainJson(train_id):
+    app.logger.info(f"[GET] Loading train {train_id} as json...")
+
+    res = isorDumper.dumpTrainPost(train_id)
+
+    if res is None:
+        return jsonify({ 'error' : "Too many requests", 'retryAfter' : isorDumper.singleQueryRequestDelay - int(time.time() - isorDumper.lastRequest_singleQuery) }), 429
+
+    if not isinstance(res, RouteResult):
+        return jsonify({ 'error' : res }), 502
+
+    data = res.toDict()
+    data['fetchedAt'] = isorDumper.responseCache.getStoredAt('train', train_id)
+    return jsonify(data)
+
+@app.route('/get/train/<train_id>/locos')
+@basic_auth.required
+def getTrainLocos(train_id):
+    ## answered from the latest results, ISOR is not asked
+    hauling, reserved = isorDumper.trainIndex.getLocosOnTrain(train_id)
+
+    return jsonify({ 'train' : train_id, 'hauling' : [loco.toDict() for loco in hauling], 'reserved' : [loco.toDict() for loco in reserved] })
+
+@app.route('/get/station/<station>/locos')
+@basic_auth.required
+def getStationLocos(station):
+    locos = isorDumper.trainIndex.getLocosAtStation(station)
+
+    return jsonify({ 'station' : station, 'locos' : [loco.toDict() for loco in locos] })
+
+## the ETag of the API answers is only valid for this run of the app
+apiStartedAt = time.time()
+apiFields = ['id', 'fullId', 'color', 'function', 'trainNum', 'trainNumReservation', 'place', 'time', 'fetchedAt']
+
+@app.route('/api/locos')
+@basic_auth.required
+def apiLocos():
+    ## latest known data of the locos in the list, answered from memory only, ISOR is never asked
+    ## ?ids=749121,925427492640 &station=Praha hl.n. &function=vlakové &state=hot|cold &fields=id,place,time
+    station = request.args.get('station')
+    function = request.args.get('function', "").casefold()
+    state = request.args.get('state')
+    fields = [field for field in request.args.get('fields', "").split(",") if field in apiFields] or apiFields
+
+    version, results = isorDumper.trainIndex.getResults(station)
+
+    ## the index also holds locos looked up one by one, those are not part of the fleet
+    results = [result for result in results if locoHandler.getLocoByFullNumber(result.fullId) is not None]
+
+    ## hot and cold change with the time alone, so their answers are valid for a minute
+    currentTime = datetime.now(ZoneInfo('Europe/Berlin'))
+    minute = currentTime.strftime("%Y%m%d%H%M") if state is not None else ""
+
+    etag = hashlib.blake2b(f"{apiStartedAt}|{version}|{locoHandler.version}|{minute}|{sorted(request.args.items(multi=True))}".encode("utf-8"), digest_size=8).hexdigest()
+    if etag in request.if_none_match:
+        return Response(status=304, headers={ 'ETag' : f'"{etag}"', 'Cache-Control' : "no-cache" })
+
+    if request.args.get('ids'):
+        ## any of the number formats, compared by the short number
+        numbers = set(locoHandler.parseFullLocoNumber(locoId.strip().replace('.', '')) for locoId in request.args['ids'].split(",") if locoId.strip() != "")
+        results = [result for result in results if result.id.replace('.', '') in numbers]
+    if function != "":
+        results = [result for result in results if function in result.function.casefold()]
+    if state is not None:
+        results = [result for result in results if TableGenerator.ContentModel.isHot(result, currentTime) == (state == 'hot')]
+
+    results.sort(key=lambda result: result.id)
+
+    def generate():
+        yield '{"version":%d,"locos":[' % version
+        for index, result in enumerate(results):
+            row = result.toDict()
+            yield ("," if index > 0 else "") + json.dumps({ field : row[field] for field in fields }, ensure_ascii=False)
+        yield ']}'
+
+    return Response(generate(), mimetype="application/json", headers={ 'ETag' : f'"{etag}"', 'Cache-Control' : "no-cache" })
+
+@app.route('/history/<loco_id>')
+@basic_auth.required
+def history(loco_id):
+    app.logger.info(f"Loading history of locomotive {loco_id}...")
+
+    if not locoHandler.checkLokoInput(loco_id):
+        return "Zadejte číslo vlaky v jednom z následujících formátů: '749121' nebo '7491210' nebo '925427491210'"
+
+    loco = locoHandler.getLoco(loco_id)
+    days = request.args.get('days', 7, type=float)
+
+    ## answered from the local history only, ISOR is not asked
+    entries = historyStore.getTimeline(loco.fullNumber, since=time.time() - days * 24 * 3600)
+
+    return tableGenerator.getHistoryTable(loco.fullNumber, entries, days)
+
+@app.route('/history/<loco_id>/json')
+@basic_auth.required
+def historyJson(loco_id):
+    if not locoHandler.checkLokoInput(loco_id):
+        return jsonify({ 'error' : "Invalid locomotive number" }), 400
+
+    loco = locoHandler.getLoco(loco_id)
+    since = request.args.get('since', None, type=float)
+    until = request.args.get('until', None, type=float)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+
+    entries = historyStore.getTimeline(loco.fullNumber, since, until, limit)
+
+    return jsonify({ 'fullId' : loco.fullNumber, 'positions' : [entry.toDict() for entry in entries] })
+
 @app.route('/list_redirect')
 def list_redirect():
 
@@ -339,7 +472,7 @@ def addloco():
 
             app.logger.debug(f"Dumping locomotive {newLoco}...")
 
-            res = isorDumper.dumpSingleLocomotive(newLoco, timeoutByPass=True)
+            res = isorDumper.dumpSingleLocomotive(newLoco, timeoutByPass=True, forceRefresh=True)
 
             if res is not None:
 
@@ -349,14 +482,19 @@ def addloco():
 
             return redirect(url_for('add_redirect'))
         
-        app.logger.debug(f"Scanning all locomotives to match the delete button...")
+        app.logger.debug(f"Matching the delete button to its locomotive...")
 
-        for loco in locoHandler.locoList:
-            if request.form.get(f"delete-{loco.fullNumber}") == "DELETE":
+        ## the button is named "delete-<full number>"
+        for key, value in request.form.items():
+            loco = locoHandler.getLocoByFullNumber(key[len("delete-"):]) if key.startswith("delete-") and value == "DELETE" else None
+            if loco is not None:
 
                 app.logger.info(f"Deleting locomotive {loco.fullNumber}...")
 
                 locoHandler.removeLoco(loco)
+                isorDumper.responseCache.invalidate('loco', loco.fullNumber)
+                isorDumper.trainIndex.remove(loco.fullNumber)
+                tableGenerator.removeIndexRow(loco.fullNumber)
                 break
 
         app.logger.debug("Generating the addition table...")
@@ -385,6 +523,24 @@ def updateData(data):
     ## to temporarily bypass the timeout and deny any other update requests
     isorDumper.lastRequest_wholeTable = time.time()
 
+def getRouteSnapshot(train_id, res):
+    return tableGenerator.getRouteSnapshot(train_id, res, isorDumper.lastRequest_singleQuery + isorDumper.singleQueryRequestDelay,
+                                           isorDumper.responseCache.getStoredAt('train', train_id), isorDumper.trainIndex.getLocosOnTrain(train_id))
+
+def snapshotResponse(snapshot):
+    ## the precompressed variant the client accepts, a matching conditional request gets 304
+    encoding, body = snapshot.negotiate(request.accept_encodings)
+
+    response = Response(body, mimetype="text/html")
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.set_etag(f"{snapshot.etag}-{encoding}" if encoding is not None else snapshot.etag)
+    response.last_modified = snapshot.publishedAt
+    response.cache_control.no_cache = True
+
+    return response.make_conditional(request)
+
 def checkTimeDelay(lastTime, delay):
     time_diff = time.time() - lastTime
     if time_diff < delay:
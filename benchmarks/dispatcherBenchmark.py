@@ -0,0 +1,107 @@
+## Measures the CPU time the IsorClient dispatcher burns per served request
+## and while idle, comparing the old spinning loops with the blocking dispatcher.
+## No network is used, the upstream call is replaced by a fixed sleep.
+##
+## usage: python benchmarks/dispatcherBenchmark.py [requests] [waiters]
+
+import os
+import sys
+import time
+import uuid
+import logging
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from isorClient import IsorClient
+from isorDataTypes import IsorRequest, IsorResponse
+from rateLimiter import AdaptiveRateLimiter
+
+UPSTREAM_LATENCY = 0.02
+REQUEST_DELAY = 0.01
+IDLE_SECONDS = 1.0
+
+class FixedRateLimiter(AdaptiveRateLimiter):
+    ## a fixed delay below POLITENESS_DELAY, only for the offline benchmarks, never for ISOR
+    def __init__(self, delay : float):
+        super().__init__(delay, delay, delay)
+        self.minDelay = self.maxDelay = delay
+        self.rate = 1 / delay
+
+class OfflineIsorClient(IsorClient):
+    ## no login and no HTTP, the upstream round trip is just a sleep
+    def loginToISOR(self):
+        self.logged = True
+        return True
+
+    def sendRequest(self, request : IsorRequest) -> IsorResponse:
+        time.sleep(UPSTREAM_LATENCY)
+        return IsorResponse(200, "", request.guid)
+
+class SpinningIsorClient(OfflineIsorClient):
+    ## the dispatcher as it used to be: both sides busy-wait
+    def __init__(self, logger, username : str, password : str):
+        super().__init__(logger, username, password)
+        self.responseDict = {}
+
+    def GetResponse(self, request : IsorRequest) -> IsorResponse:
+        self.requestQueue.put(request)
+
+        while request.guid not in self.responseDict:
+            pass
+
+        return self.responseDict.pop(request.guid)
+
+    def RequestHandler(self):
+        while not self.stopEvent.is_set():
+            if (time.time() - self.lastRequest) > REQUEST_DELAY and not self.requestQueue.empty():
+                request = self.requestQueue.get()
+                if request is None:
+                    break
+                self.responseDict[request.guid] = self.sendRequest(request)
+                self.lastRequest = time.time()
+
+def measure(clientClass, requestCount : int, waiterCount : int):
+    client = clientClass(logging.getLogger("benchmark"), "", "")
+    client.rateLimiter = FixedRateLimiter(REQUEST_DELAY)
+    handler = threading.Thread(target=client.RequestHandler, daemon=True)
+    handler.start()
+
+    ## idle: nobody is asking for anything
+    cpuStart = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idleCpu = time.process_time() - cpuStart
+
+    ## busy: several waiters share the served requests
+    ## distinct bodies, so identical requests are not coalesced
+    def waiter(count):
+        for _ in range(count):
+            client.GetResponse(IsorRequest("http://localhost/", { 'id' : str(uuid.uuid4()) }))
+
+    perWaiter = max(1, requestCount // waiterCount)
+    threads = [threading.Thread(target=waiter, args=(perWaiter,)) for _ in range(waiterCount)]
+
+    wallStart = time.time()
+    cpuStart = time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    busyCpu = time.process_time() - cpuStart
+    wall = time.time() - wallStart
+
+    client.Stop()
+    handler.join(timeout=1)
+
+    served = perWaiter * waiterCount
+    return idleCpu, busyCpu / served, wall
+
+if __name__ == "__main__":
+    requestCount = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    waiterCount = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    print(f"{requestCount} requests, {waiterCount} waiting threads, {UPSTREAM_LATENCY * 1000:.0f} ms upstream latency")
+    print(f"{'dispatcher':<12}{'idle CPU [s/s]':>16}{'CPU/request [ms]':>20}{'wall [s]':>12}")
+    for name, clientClass in (("spinning", SpinningIsorClient), ("blocking", OfflineIsorClient)):
+        idleCpu, cpuPerRequest, wall = measure(clientClass, requestCount, waiterCount)
+        print(f"{name:<12}{idleCpu / IDLE_SECONDS:>16.3f}{cpuPerRequest * 1000:>20.3f}{wall:>12.2f}")
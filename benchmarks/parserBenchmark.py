@@ -0,0 +1,93 @@
+## Parses the captured ISOR pages in benchmarks/corpus, checks the parsed fields against
+## corpus/expected.json and reports time per page, throughput and peak memory per page.
+## Exits with 1 when a page parses differently than expected, so regex changes can be checked.
+##
+## usage: python benchmarks/parserBenchmark.py [secondsPerPage]
+
+import os
+import sys
+import json
+import time
+import logging
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dumper import IsorDumper
+from isorParser import LocoPageParser
+from locoHandler import LocoExportModel
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+LOCO_FIELDS = ["function", "trainNum", "trainNumReservation", "place", "time"]
+
+locoPageParser = LocoPageParser()
+dumper = IsorDumper(logging.getLogger("benchmark"), None, baseUrl="http://localhost")
+
+def parseLocoPage(html : str) -> LocoExportModel:
+    return locoPageParser.parse(html).applyTo(LocoExportModel("749.121", "925427491210", ""))
+
+def parseRoutePage(html : str):
+    return dumper.parseTrainPage(html)
+
+def summarizeLoco(exportModel : LocoExportModel) -> dict:
+    return { field : getattr(exportModel, field) for field in LOCO_FIELDS }
+
+def summarizeRoute(route) -> dict:
+    return { 'stops' : len(route.stops), 'first' : route.stops[0].station, 'last' : route.stops[-1].station }
+
+def loadCorpus() -> tuple[dict[str, str], dict[str, dict]]:
+    pages = {}
+    for fileName in sorted(os.listdir(CORPUS_PATH)):
+        if fileName.endswith(".html"):
+            with open(os.path.join(CORPUS_PATH, fileName), "r", encoding="utf-8") as file:
+                pages[fileName] = file.read()
+
+    with open(os.path.join(CORPUS_PATH, "expected.json"), "r", encoding="utf-8") as file:
+        expected = json.load(file)
+
+    return pages, expected
+
+def pick(fileName : str):
+    if fileName.startswith("D1320"):
+        return parseLocoPage, summarizeLoco
+    return parseRoutePage, summarizeRoute
+
+def timePage(parse, html : str, seconds : float) -> tuple[float, int]:
+    ## repeat for about the given time, at least ten times
+    iterations = 0
+    start = time.perf_counter()
+    while iterations < 10 or time.perf_counter() - start < seconds:
+        parse(html)
+        iterations += 1
+    return (time.perf_counter() - start) / iterations, iterations
+
+def peakMemory(parse, html : str) -> int:
+    tracemalloc.start()
+    parse(html)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+if __name__ == "__main__":
+    secondsPerPage = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    pages, expected = loadCorpus()
+    failures = []
+
+    print(f"{'page':<34}{'size [kB]':>10}{'parse [us]':>12}{'pages/s':>12}{'peak [kB]':>11}  check")
+    for fileName, html in pages.items():
+        parse, summarize = pick(fileName)
+
+        summary = summarize(parse(html))
+        matches = summary == expected.get(fileName)
+        if not matches:
+            failures.append((fileName, summary, expected.get(fileName)))
+
+        perPage, _ = timePage(parse, html, secondsPerPage)
+        peak = peakMemory(parse, html)
+
+        print(f"{fileName:<34}{len(html) / 1024:>10.1f}{perPage * 1e6:>12.1f}{1 / perPage:>12.0f}{peak / 1024:>11.1f}  {'ok' if matches else 'MISMATCH'}")
+
+    for fileName, summary, expectedSummary in failures:
+        print(f"\n{fileName}\n  parsed:   {summary}\n  expected: {expectedSummary}")
+
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,69 @@
+## Measures how long interactive lookups wait while a bulk fleet refresh is queued,
+## with every request in one FIFO class versus interactive requests prioritised.
+## No network is used, the upstream call is replaced by a fixed sleep.
+##
+## usage: python benchmarks/priorityBenchmark.py [bulkRequests] [interactiveRequests]
+
+import os
+import sys
+import time
+import logging
+import threading
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dispatcherBenchmark import OfflineIsorClient, FixedRateLimiter
+from isorDataTypes import IsorRequest, RequestPriority
+
+REQUEST_DELAY = 0.005
+INTERACTIVE_GAP = 0.05
+
+def percentile(values : list[float], percent : float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def measure(interactivePriority : RequestPriority, bulkCount : int, interactiveCount : int):
+    client = OfflineIsorClient(logging.getLogger("benchmark"), "", "")
+    client.rateLimiter = FixedRateLimiter(REQUEST_DELAY)
+    handler = threading.Thread(target=client.RequestHandler, daemon=True)
+    handler.start()
+
+    wallStart = time.time()
+    bulkFutures = client.SubmitMany([IsorRequest("http://localhost/D1320", { 'cisloLokomotivy' : f"bulk-{i}" }, RequestPriority.BULK) for i in range(bulkCount)])
+
+    ## dispatchers click independently of each other while the refresh runs
+    latencies = []
+    def lookup(number):
+        start = time.time()
+        client.GetResponse(IsorRequest("http://localhost/D1320", { 'cisloLokomotivy' : f"lookup-{number}" }, interactivePriority))
+        latencies.append(time.time() - start)
+
+    lookups = []
+    for number in range(interactiveCount):
+        time.sleep(INTERACTIVE_GAP)
+        thread = threading.Thread(target=lookup, args=(number,))
+        thread.start()
+        lookups.append(thread)
+
+    for thread in lookups:
+        thread.join()
+
+    for future in bulkFutures:
+        future.result()
+    wall = time.time() - wallStart
+
+    client.Stop()
+    handler.join(timeout=1)
+
+    return statistics.median(latencies), percentile(latencies, 99), wall
+
+if __name__ == "__main__":
+    bulkCount = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    interactiveCount = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    print(f"{bulkCount} bulk requests queued, {interactiveCount} interactive lookups during the refresh")
+    print(f"{'scheduling':<14}{'p50 [ms]':>12}{'p99 [ms]':>12}{'bulk done [s]':>16}")
+    for name, priority in (("fifo", RequestPriority.BULK), ("priority", RequestPriority.INTERACTIVE)):
+        p50, p99, wall = measure(priority, bulkCount, interactiveCount)
+        print(f"{name:<14}{p50 * 1000:>12.1f}{p99 * 1000:>12.1f}{wall:>16.2f}")
@@ -0,0 +1,87 @@
+## Renders the index table for a generated fleet with the previous renderer (a template file read,
+## a chain of str.replace and rows += per row) and with the compiled templates, once with an empty
+## row cache and once with every row cached. Checks that both renderers produce the same page.
+##
+## usage: python benchmarks/renderBenchmark.py [rows ...]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from locoHandler import LocoExportModel
+from tableGenerator import TableGenerator
+from fleetIndex import FleetQuery
+
+class LegacyTableGenerator(TableGenerator):
+    ## the renderer as it was before the compiled templates
+    def fillTable(self, response, updateTime, nextUpdateTime, progress = None):
+        rows = ""
+        for data in response.hotLocomotives:
+            rows += self.fillTableRow(data)
+        rows += open(self.templateTableEmptyRowPath, "r", encoding="utf-8").read()
+        for data in response.coldLocomotives:
+            rows += self.fillTableRow(data)
+
+        template = open(self.templateTablePath, "r", encoding="utf-8").read()
+        template = template.replace("[TABLE-ROWS]", rows)
+        template = template.replace("[TABLE-LAST-UPDATE]", updateTime)
+        template = template.replace("[TABLE-NEXT-UPDATE]", nextUpdateTime)
+        template = template.replace("[TABLE-PROGRESS]", self.fillProgressRow(progress))
+        template = template.replace("[TABLE-HEAD]", "")
+        template = template.replace("[TABLE-FILTER]", self.fillFilterForm(FleetQuery()))
+        template = template.replace("[TABLE-PAGER]", "")
+        return template
+
+    def renderTableRow(self, data):
+        template = open(self.templateTableRowPath, "r", encoding="utf-8").read()
+        template = template.replace("[LOCO_ID]", data.id)
+        template = template.replace("[LOCO_FULL_ID]", data.fullId)
+        if (data.color is not None):
+            template = template.replace("[LOCO_COLOR]", data.color)
+        template = template.replace("[LOCO_FUNCTION]", data.function)
+        template = template.replace("[LOCO_TRAIN_NUM]", data.trainNum)
+        template = template.replace("[LOCO_TRAIN_NUM_RESERVATION]", data.trainNumReservation)
+        template = template.replace("[LOCO_POSITION]", data.place)
+        template = template.replace("[LOCO_TIME]", data.time)
+        return template
+
+def generateFleet(count : int) -> list[LocoExportModel]:
+    random.seed(count)
+    fleet = []
+    for index in range(count):
+        number = f"{700000 + index:06d}"
+        moved = random.random() < 0.3
+        fleet.append(LocoExportModel(f"{number[:3]}.{number[3:]}", f"92542{number}0", random.choice(["berta_modra", "cd_cargo", None]),
+                                     "1. vlakové HV" if moved else "", str(random.randint(100, 99999)) if moved else "---", "---",
+                                     random.choice(["+Praha hl.n.", "-Kolín", "Plzeň hl.n."]), "18.10.2026 16:22" if moved else "01.01.2024 08:00"))
+    return fleet
+
+def timeRender(generator : TableGenerator, fleet : list[LocoExportModel], clearRowCache : bool, repeat : int) -> tuple[float, str]:
+    best = None
+    for _ in range(repeat):
+        if clearRowCache:
+            generator.rowCache.clear()
+        start = time.perf_counter()
+        page = generator.createTable(fleet, "2026-10-18 16:30:00", "2026-10-18 17:00:00")
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, page
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] or [5000, 50000]
+
+    print(f"{'rows':>8}{'legacy [ms]':>14}{'compiled [ms]':>15}{'cached [ms]':>13}{'speedup':>10}  check")
+    for size in sizes:
+        fleet = generateFleet(size)
+        repeat = 3 if size <= 10000 else 1
+
+        legacyTime, legacyPage = timeRender(LegacyTableGenerator("output.html"), fleet, True, repeat)
+        compiled = TableGenerator("output.html")
+        compiledTime, compiledPage = timeRender(compiled, fleet, True, repeat)
+        cachedTime, _ = timeRender(compiled, fleet, False, repeat)
+
+        print(f"{size:>8}{legacyTime * 1000:>14.1f}{compiledTime * 1000:>15.1f}{cachedTime * 1000:>13.1f}{legacyTime / compiledTime:>9.1f}x  {'ok' if legacyPage == compiledPage else 'MISMATCH'}")
@@ -1,27 +1,36 @@
-import re
 import time
+import queue
+import threading
+import functools
+import concurrent.futures
 from flask import Flask
 from locoHandler import Loco, LocoExportModel
 from isorClient import IsorClient
-from isorDataTypes import IsorRequest
+from isorDataTypes import IsorRequest, IsorResponse, RequestPriority
+from responseCache import ResponseCache
+from historyStore import HistoryStore
+from trainIndex import TrainIndex
+from isorParser import LocoPageParser, LocoPageResult, RoutePageParser, RouteResult
 
 class IsorDumper:
-    def __init__(self, logger : Flask.logger, isorClient : IsorClient):            
-        self.url_login = "https://isor.spravazeleznic.cz/Login/Login"
-        self.url_request_loco = "https://isor.spravazeleznic.cz/Dotazy/D1320"
-        self.url_request_train = "https://isor.spravazeleznic.cz/Dotazy/D2040"
-        self.url_mainpage = "https://isor.spravazeleznic.cz/"
-
-        ## REGEX
-        self.searchRexeg = "(\d\d\d\d\d \d\d\d\d\d\d-\d  \D*[\+\-]?.*\d\d.\d\d.\d\d\d\d \d\d:\d\d)"
-        self.correctRowRegex = "(\d\d\d\d [+|-]\D* \d\d.\d\d.\d\d\d\d \d\d:\d\d \d\d\d\d\d\d \d.\D*)"
-        self.lastStationRegex = "(\D* )"
-        self.datumRegex = "(\d\d.\d\d.\d\d\d\d \d\d:\d\d)"
-        self.trainNumberRegex = "( \d\d\d\d\d\d )"
-        self.postrRegex = "\d\. [\D]* HV"
-        self.trainPositionsRegex = "(<pre>([\s\S]*|[\w\W]*|[\d\D]*)<\/pre>)"
-
-        self.reservationHeadingText = "stanice zahájení     funkce               vlak   stanice cílová/odst  stanice zahájení     funkce               vlak   stanice cílová/odst"
+    def __init__(self, logger : Flask.logger, isorClient : IsorClient, baseUrl : str = None, historyStore : HistoryStore = None):
+        ## by default ask the same portal the client is logged in to
+        baseUrl = (baseUrl if baseUrl is not None else isorClient.baseUrl).rstrip("/")
+        self.url_login = f"{baseUrl}/Login/Login"
+        self.url_request_loco = f"{baseUrl}/Dotazy/D1320"
+        self.url_request_train = f"{baseUrl}/Dotazy/D2040"
+        self.url_mainpage = f"{baseUrl}/"
+
+        ## PARSERS
+        self.locoPageParser = LocoPageParser()
+        self.routePageParser = RoutePageParser()
+        self.parseWorkers = 2 ## threads parsing the refresh responses
+
+        ## unchanged pages reuse their previous parse, keyed by loco full number
+        self.pageFingerprints : dict[str, tuple[bytes, LocoPageResult]] = {}
+        self.parsesDone = 0
+        self.parsesSkipped = 0
+        self.parseStatsLock = threading.Lock() ## the parse pool threads share the fingerprints and counters
 
         ## seconds between requests
         self.lastRequest_wholeTable = 0
@@ -29,15 +38,30 @@ class IsorDumper:
         self.wholeTableRequestDelay = 1800
         self.singleQueryRequestDelay = 10
 
+        ## recent parsed answers, served without asking ISOR again
+        self.responseCache = ResponseCache({ 'loco' : 900, 'train' : 120 }, maxEntries=2000)
+
+        ## every answered position is kept locally, None turns it off
+        self.historyStore = historyStore
+
+        ## trains and stations to the locos on them, from the latest results
+        self.trainIndex = TrainIndex()
+
         self.isorClient = isorClient
         self._logger = logger
 
-    def dumpSingleLocomotive(self, locomotive : Loco, timeoutByPass = False) -> LocoExportModel:
+    def dumpSingleLocomotive(self, locomotive : Loco, timeoutByPass = False, forceRefresh = False) -> LocoExportModel:
 
         time_diff = (time.time() - self.lastRequest_singleQuery)
 
         self._logger.info(f"Trying to dump single locomotive {locomotive.number}...")
 
+        if not forceRefresh:
+            cached = self.responseCache.get('loco', locomotive.fullNumber)
+            if cached is not None:
+                self._logger.debug(f"Locomotive {locomotive.number} served from cache, {int(cached.age())}s old")
+                return cached.value
+
         if ((time_diff > self.singleQueryRequestDelay) or timeoutByPass):
 
             result = self.dumpLocomotivePOST(locomotive)
@@ -48,179 +72,168 @@ class IsorDumper:
             self._logger.debug(f"Request too soon: {(self.singleQueryRequestDelay - time_diff)}s remaining")
             return None
 
-    def dumpLocomotivePOST(self, locomotive : Loco) -> LocoExportModel:        
-        ## default values
-        exportModel = LocoExportModel(f"{locomotive.number[:-3]}.{locomotive.number[3:]}", locomotive.fullNumber, locomotive.color)
-        cutLenght = 0
+    def dumpLocomotivePOST(self, locomotive : Loco, priority : RequestPriority = RequestPriority.INTERACTIVE) -> LocoExportModel:
+        exportModel = self.fetchLocomotivePOST(locomotive, priority)
 
-        self._logger.info(f"Dumping locomotive {locomotive.number}...")
+        ## only answered requests are worth remembering
+        if exportModel.fetchedAt is not None:
+            self.responseCache.put('loco', locomotive.fullNumber, exportModel, exportModel.fetchedAt)
+            self.recordResult(exportModel)
 
-        requestBody = { 'cisloLokomotivy' : locomotive.fullNumber }
+        return exportModel
 
-        response = self.isorClient.GetResponse(IsorRequest(self.url_request_loco, requestBody))
+    def recordResult(self, exportModel : LocoExportModel):
+        self.trainIndex.update(exportModel)
+        self.recordHistory(exportModel)
 
-        ## update the last request time
-        self.lastRequest = time.time()
+    def recordHistory(self, exportModel : LocoExportModel):
+        if self.historyStore is None:
+            return
 
-        if response.status == 200:
-            foundCurrentData = True
-            ## get the respnse text
-            html = response.text
+        try:
+            self.historyStore.record(exportModel)
+        except Exception as e: ## the history is a side product, the answer still goes out
+            self._logger.warning(f"Couldn't record history of locomotive {exportModel.id}: {e}")
 
-            if foundCurrentData:
+    def fetchLocomotivePOST(self, locomotive : Loco, priority : RequestPriority = RequestPriority.INTERACTIVE) -> LocoExportModel:
+        self._logger.info(f"Dumping locomotive {locomotive.number}...")
 
-                self._logger.debug(f"Trying to find correctRow with regex")
+        response = self.isorClient.GetResponse(self.createLocomotiveRequest(locomotive, priority))
 
-                ## get the last known-position
-                matches = re.findall(self.correctRowRegex, html)
-                if (len(matches) == 0 or len(matches[0]) == 0):
+        ## update the last request time
+        self.lastRequest = time.time()
 
-                    self._logger.debug(f"Couldn't find correctRow for locomotive {locomotive.number}")
+        return self.parseLocomotiveResponse(locomotive, response, self.lastRequest)
 
-                    foundCurrentData = False
-                else:
-                    firstBestRow = matches[0].strip()
-            
-            if foundCurrentData:
-                self._logger.debug(f"Trying to find funkceLoko with regex")
+    def createLocomotiveRequest(self, locomotive : Loco, priority : RequestPriority) -> IsorRequest:
+        requestBody = { 'cisloLokomotivy' : locomotive.fullNumber }
 
-                ## get the funkceLoko
-                funkceMatch = re.findall(self.postrRegex, firstBestRow)
-                if (len(funkceMatch) == 0 or len(funkceMatch[0]) == 0):    
-                    self._logger.debug(f"Couldn't find funkceLoko for locomotive {locomotive.number}")
-                else:
-                    exportModel.function = funkceMatch[0].strip()
-    
-            if foundCurrentData:
+        return IsorRequest(self.url_request_loco, requestBody, priority)
 
-                self._logger.debug(f"Trying to find last station with regex")
+    def parseLocomotiveResponse(self, locomotive : Loco, response : IsorResponse, receivedAt : float) -> LocoExportModel:
+        ## default values
+        exportModel = LocoExportModel(f"{locomotive.number[:-3]}.{locomotive.number[3:]}", locomotive.fullNumber, locomotive.color)
 
-                ## get the train position
-                firstBestRow = firstBestRow[5:] ## shorten by the unused input
-                positionMatch = re.findall(self.lastStationRegex, firstBestRow)
-                if (len(positionMatch) == 0 or len(positionMatch[0]) == 0):
+        if response is not None and response.status == 200:
+            exportModel.fetchedAt = receivedAt
 
-                    self._logger.debug(f"Couldn't find last station for locomotive {locomotive.number}")
+            result = self.parseLocomotivePage(locomotive, response.text)
 
-                    foundCurrentData = False
-                else:
-                    cutLenght = len(positionMatch[0])
-                    exportModel.place = positionMatch[0].strip()
+            if not result.hasCurrentPosition:
+                self._logger.debug(f"Couldn't find current position for locomotive {locomotive.number}.")
 
-            if foundCurrentData:
+                if not result.hasLastKnownPosition:
+                    self._logger.debug(f"Couldn't find last known position for locomotive {locomotive.number}.")
 
-                self._logger.debug(f"Trying to find date with regex")
+            if result.hasReservations:
+                self._logger.debug(f"Locomotive {locomotive.number} has reservations!")
 
-                firstBestRow = firstBestRow[cutLenght:] ## shorten by the parsed input
-                dateMatch = re.findall(self.datumRegex, firstBestRow)
-                if (len(dateMatch) == 0 or len(dateMatch[0]) == 0):
+            result.applyTo(exportModel)
 
-                    self._logger.debug(f"Couldn't find date for locomotive {locomotive.number}")
-                    
-                    foundCurrentData = False
-                else:
-                    cutLenght = len(dateMatch[0])
-                    exportModel.time = dateMatch[0].strip()
+        ## return the result
+        return exportModel
             
-            if foundCurrentData:
-
-                self._logger.debug(f"Trying to find train number with regex")
+    def parseLocomotivePage(self, locomotive : Loco, html : str) -> LocoPageResult:
+        fingerprint = self.locoPageParser.fingerprint(html)
 
-                firstBestRow = firstBestRow[cutLenght:] ## shorten by the parsed input
-                trainNumberMatch = re.findall(self.trainNumberRegex, firstBestRow)
-                if (len(trainNumberMatch) == 0 or len(trainNumberMatch[0]) == 0):
+        with self.parseStatsLock:
+            previous = self.pageFingerprints.get(locomotive.fullNumber)
+            if previous is not None and previous[0] == fingerprint:
+                self.parsesSkipped += 1
+                return previous[1]
 
-                    self._logger.debug(f"Couldn't find train number for locomotive {locomotive.number}")
+        ## parsed outside the lock, the pool threads parse in parallel
+        result = self.locoPageParser.parse(html)
 
-                    foundCurrentData = False
-                else:
-                    exportModel.trainNum = trainNumberMatch[0].strip().lstrip('0')
-            
-            if not foundCurrentData:
+        with self.parseStatsLock:
+            self.pageFingerprints[locomotive.fullNumber] = (fingerprint, result)
+            self.parsesDone += 1
 
-                self._logger.debug(f"Couldn't find current position for locomotive {locomotive.number}. Trying to find last known position...")
+        return result
 
-                oldPositionMatch = re.findall(self.searchRexeg, html)
-                if (len(oldPositionMatch) == 0 or len(oldPositionMatch[0]) == 0):
+    def getParseStats(self) -> dict:
+        with self.parseStatsLock:
+            return { 'parsesDone' : self.parsesDone, 'parsesSkipped' : self.parsesSkipped }
 
-                    self._logger.debug(f"Couldn't find last known position for locomotive {locomotive.number}.")
+    def dumpLocomotivesPOST(self, locomotives : list[Loco]) -> list[LocoExportModel]:
+        result : list[LocoExportModel] = [None] * len(locomotives)
 
-                    return exportModel 
-                
-                cutLenght = len(oldPositionMatch[0])
-                oldPosition = oldPositionMatch[0].strip()
+        for index, exportModel in self.dumpLocomotivesStream(locomotives):
+            result[index] = exportModel
 
-                self._logger.debug(f"Trying to find date with regex from last known position...")
+        return result
 
-                datumMatch = re.findall(self.datumRegex, oldPositionMatch[0])
-                if (len(datumMatch) == 0 or len(datumMatch[0]) == 0):
+    def dumpLocomotivesStream(self, locomotives : list[Loco]):
+        ## yields (index, LocoExportModel) in the order the locomotives get parsed
+        self._logger.debug("Dumping locomotives...")
 
-                    self._logger.debug(f"Couldn't find last known position for locomotive {locomotive.number}.")
+        ## the whole fleet is queued at once, so the client never waits for parsing before the next request,
+        ## the refresh yields to interactive lookups
+        requestFutures = self.isorClient.SubmitMany([self.createLocomotiveRequest(locomotive, RequestPriority.BULK) for locomotive in locomotives])
 
-                    return exportModel
-                
-                cutLenght = len(datumMatch[0])
-                exportModel.time = datumMatch[0].strip()
+        ## parsing runs in the pool while the next responses are still on their way
+        parsedQueue = queue.Queue()
+        parsePool = concurrent.futures.ThreadPoolExecutor(max_workers=self.parseWorkers)
 
-                oldPosition = oldPosition[14:-cutLenght].strip() ## remove the loconumber ("91547 380004-2") and the datum at the end
+        def parseWhenAnswered(index : int, requestFuture : concurrent.futures.Future):
+            try:
+                parsePool.submit(self.parseIntoQueue, index, locomotives[index], requestFuture, parsedQueue)
+            except RuntimeError: ## the consumer stopped listening and the pool is shut down
+                pass
 
-                if ' +' in oldPosition:
-                    exportModel.place = f"+{oldPosition.split(' +')[1].strip()}"
-                elif ' -' in oldPosition:
-                    exportModel.place = f"-{oldPosition.split(' -')[1].strip()}"
-                else: ## no + or - in the string
-                    exportModel.place = list(filter(None, oldPosition.split("  ")))[1].strip()
-            
-            self._logger.debug(f"Trying to find reservations for locomotive {locomotive.number}...")
+        try:
+            for index, requestFuture in enumerate(requestFutures):
+                requestFuture.add_done_callback(functools.partial(parseWhenAnswered, index))
 
-            ## check reservations
-            if self.reservationHeadingText in html:
+            for _ in range(len(locomotives)):
+                yield parsedQueue.get()
+        finally:
+            parsePool.shutdown(wait=False, cancel_futures=True)
 
-                self._logger.debug(f"Locomotive {locomotive.number} has reservations!")
+            for requestFuture in requestFutures:
+                requestFuture.cancel()
 
-                index = html.index(self.reservationHeadingText)
-                html = html[index:]
+            ## the refresh is over, write the rest of its history batch
+            if self.historyStore is not None:
+                self.historyStore.flush()
 
-                self._logger.debug(f"Trying to find train number with regex from reservations...")
+    def parseIntoQueue(self, index : int, locomotive : Loco, requestFuture : concurrent.futures.Future, parsedQueue : queue.Queue):
+        try:
+            exportModel = self.parseBulkResponse(locomotive, requestFuture)
+        except Exception as e: ## the consumer waits for exactly one result per loco
+            self._logger.warning(f"Couldn't parse data for locomotive {locomotive.number}: {e}")
 
-                reservationTrainNum = re.findall(self.trainNumberRegex, html)
-                if (len(reservationTrainNum) == 0 or len(reservationTrainNum[0]) == 0):
+            exportModel = self.parseLocomotiveResponse(locomotive, None, time.time())
 
-                    self._logger.debug(f"Couldn't find reservation train number for locomotive {locomotive.number}.")
+        parsedQueue.put((index, exportModel))
 
-                else:
-                    ## default backup value
-                    nextTrainNum = "---"
-
-                    ## first try the first reservation
-                    tempNextTrainNum = reservationTrainNum[0].strip().lstrip('0')
-                    if (tempNextTrainNum != exportModel.trainNum): ## if different from the current train
-                            nextTrainNum = tempNextTrainNum
-                    else:
-                    ## secondly try the second reservation
-                        if (len(reservationTrainNum) > 1): ## if there are more reservations, usually the first is for the same train, skip it
-                            tempNextTrainNum = reservationTrainNum[1].strip().lstrip('0') ## take the second reservation
-                            if (tempNextTrainNum != exportModel.trainNum): ## if different from the current train
-                                nextTrainNum = tempNextTrainNum
-
-                    exportModel.trainNumReservation = nextTrainNum ## save the reservation
+    def parseBulkResponse(self, locomotive : Loco, requestFuture : concurrent.futures.Future) -> LocoExportModel:
+        receivedAt = time.time()
+        response = None
 
-        ## return the result
-        return exportModel
-            
-    def dumpLocomotivesPOST(self, locomotives : list[Loco]) -> list[LocoExportModel]:
-        self._logger.debug("Dumping locomotives...")
+        try:
+            response = requestFuture.result()
+        except Exception as e: ## a single failed loco must not fail the whole refresh
+            self._logger.warning(f"Couldn't get data for locomotive {locomotive.number}: {e}")
 
-        result = list(map(self.dumpLocomotivePOST, locomotives))
+        exportModel = self.parseLocomotiveResponse(locomotive, response, receivedAt)
 
-        self.lastRequest_wholeTable = time.time()
+        if exportModel.fetchedAt is not None:
+            self.responseCache.put('loco', locomotive.fullNumber, exportModel, exportModel.fetchedAt)
+            self.recordResult(exportModel)
 
-        return result
+        return exportModel
 
-    def dumpTrainPost(self, train, timeoutByPass = False):
+    def dumpTrainPost(self, train, timeoutByPass = False, forceRefresh = False):
 
         self._logger.debug("Trying to dump train...")
 
+        if not forceRefresh:
+            cached = self.responseCache.get('train', train)
+            if cached is not None:
+                self._logger.debug(f"Train {train} served from cache, {int(cached.age())}s old")
+                return cached.value
+
         time_diff = (time.time() - self.lastRequest_singleQuery)
 
         if ((time_diff > self.singleQueryRequestDelay) or timeoutByPass):
@@ -234,15 +247,15 @@ class IsorDumper:
             self.lastRequest_singleQuery = time.time()
 
             if response.status == 200:
-                html = response.text
-                matchings = re.findall(self.trainPositionsRegex, html)
-                if (len(matchings) == 0 or len(matchings[0]) == 0):
+                route = self.parseTrainPage(response.text, train)
+                if route is None:
 
                     self._logger.debug(f"Couldn't parse train detail {train}.")
 
                     return "Couldn't parse data"
                 else:
-                    return matchings[0][0]
+                    self.responseCache.put('train', train, route)
+                    return route
             else:
 
                 self._logger.debug(f"Couldn't get data for train {train}: ERROR {response.status}")
@@ -250,4 +263,7 @@ class IsorDumper:
             
         else:
             self._logger.debug(f"Request too soon, {(self.singleQueryRequestDelay - time_diff)}s remaining...")
-            return None
\ No newline at end of file
+            return None
+
+    def parseTrainPage(self, html : str, train : str = "") -> RouteResult:
+        return self.routePageParser.parse(html, train)
@@ -0,0 +1,308 @@
+import os
+import time
+import uuid
+import random
+import argparse
+import threading
+from zoneinfo import ZoneInfo
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+from http.cookies import SimpleCookie
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+## Local stand-in for the ISOR portal, serving /Login/Login, /Dotazy/D1320 and /Dotazy/D2040
+## from the page bodies in data/fakeIsor, so the client can be tested without the real portal.
+
+class FakeIsorSession:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.authenticated = False
+        self.loggedAt = 0
+
+class FakeIsorServer:
+    scenarios = ["moving", "reserved", "parked", "nodata"]
+
+    stations = ["Praha hl.n.", "Praha-Libeň", "Kolín", "Pardubice hl.n.", "Česká Třebová", "Olomouc hl.n.", "Přerov",
+                "Ostrava hl.n.", "Bohumín", "Brno hl.n.", "Břeclav", "Plzeň hl.n.", "Cheb", "Ústí nad Labem hl.n.", "Děčín hl.n."]
+
+    def __init__(self, host : str = "127.0.0.1", port : int = 0, latency : float = 0, errorRate : float = 0, sessionLifetime : float = 60 * 60,
+                 credentials : tuple = None, pagesPath : str = None, seed : int = None):
+        self.host = host
+        self.port = port
+
+        ## behaviour
+        self.latency = latency
+        self.errorRate = errorRate
+        self.sessionLifetime = sessionLifetime
+        self.credentials = credentials ## None accepts any non-empty username and password
+        self.random = random.Random(seed)
+
+        ## page bodies
+        self.pagesPath = pagesPath if pagesPath is not None else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fakeIsor")
+        self.pages = self.loadPages()
+        self.locoScenarios : dict[str, str] = {} ## forced scenario per requested loco number
+
+        ## state
+        self.sessions : dict[str, FakeIsorSession] = {}
+        self.sessionsLock = threading.Lock()
+        self.requestCounts : dict[str, int] = {}
+        self.loginCount = 0
+        self.countsLock = threading.Lock() ## the handler threads count concurrently
+
+        self.httpServer = None
+        self.thread = None
+
+    @property
+    def baseUrl(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self.httpServer = ThreadingHTTPServer((self.host, self.port), FakeIsorRequestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.fakeIsor = self
+        self.port = self.httpServer.server_address[1]
+
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpServer is not None:
+            self.httpServer.shutdown()
+            self.httpServer.server_close()
+            self.httpServer = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def loadPages(self) -> dict[str, str]:
+        pages = {}
+        for fileName in os.listdir(self.pagesPath):
+            if fileName.endswith(".html"):
+                with open(os.path.join(self.pagesPath, fileName), "r", encoding="utf-8") as file:
+                    pages[fileName[:-5]] = file.read()
+        return pages
+
+    def setScenario(self, locoNumber : str, scenario : str):
+        if scenario not in self.scenarios:
+            raise ValueError(f"Unknown scenario {scenario}")
+        self.locoScenarios[locoNumber] = scenario
+
+    def expireSessions(self):
+        ## behaves as if every login timed out on the portal side
+        with self.sessionsLock:
+            for session in self.sessions.values():
+                session.authenticated = False
+
+    def countRequest(self, method : str, path : str):
+        key = f"{method} {path}"
+        with self.countsLock:
+            self.requestCounts[key] = self.requestCounts.get(key, 0) + 1
+
+    def getRequestCounts(self) -> dict[str, int]:
+        with self.countsLock:
+            return dict(self.requestCounts)
+
+    ## sessions
+
+    def getSession(self, sessionId : str) -> FakeIsorSession:
+        with self.sessionsLock:
+            session = self.sessions.get(sessionId)
+            if session is None:
+                session = FakeIsorSession()
+                self.sessions[session.id] = session
+
+            if session.authenticated and time.time() - session.loggedAt > self.sessionLifetime:
+                session.authenticated = False
+
+            return session
+
+    def login(self, session : FakeIsorSession, username : str, password : str) -> bool:
+        if self.credentials is not None:
+            valid = (username, password) == self.credentials
+        else:
+            valid = username != "" and password != ""
+
+        if valid:
+            session.authenticated = True
+            session.loggedAt = time.time()
+            with self.countsLock:
+                self.loginCount += 1
+        return valid
+
+    ## pages
+
+    def renderLayout(self, title : str, content : str) -> str:
+        return self.pages["layout"].replace("[PAGE-TITLE]", title).replace("[PAGE-CONTENT]", content)
+
+    def renderLoginPage(self) -> str:
+        return self.renderLayout("Přihlášení", self.pages["login"])
+
+    def renderMainPage(self) -> str:
+        return self.renderLayout("Úvod", self.pages["main"])
+
+    def renderLocoForm(self, query : str = "") -> str:
+        return self.pages["D1320_form"].replace("[LOCO-QUERY]", query)
+
+    def renderTrainForm(self, query : str = "") -> str:
+        return self.pages["D2040_form"].replace("[TRAIN-QUERY]", query)
+
+    def renderLocoPage(self, locoNumber : str) -> str:
+        ## every loco number always gets the same story, only the times follow the clock
+        rng = random.Random(locoNumber)
+        scenario = self.locoScenarios.get(locoNumber, rng.choice(self.scenarios))
+        now = datetime.now(ZoneInfo('Europe/Berlin')).replace(tzinfo=None)
+        route = rng.sample(self.stations, 5)
+        lastMove = now - timedelta(minutes=rng.randint(1, 300))
+
+        content = self.pages[f"D1320_{scenario}"]
+        content = content.replace("[FORM]", self.renderLocoForm(locoNumber))
+        content = content.replace("[NOW]", now.strftime("%d.%m.%Y %H:%M"))
+        content = content.replace("[LOCO-UIC]", self.formatUicNumber(locoNumber))
+        content = content.replace("[STATION-PAD]", route[0].ljust(20))
+        content = content.replace("[STATION-TO-PAD]", route[3].ljust(20))
+        content = content.replace("[STATION-PREV]", route[1])
+        content = content.replace("[STATION-FROM]", route[2])
+        content = content.replace("[STATION-DEPOT]", f"Depo {route[4]}")
+        content = content.replace("[STATION]", route[0])
+        content = content.replace("[TIME-PREV]", (lastMove - timedelta(minutes=rng.randint(10, 90))).strftime("%d.%m.%Y %H:%M"))
+        content = content.replace("[TIME-OLD]", (now - timedelta(days=rng.randint(2, 30))).strftime("%d.%m.%Y %H:%M"))
+        content = content.replace("[TIME]", lastMove.strftime("%d.%m.%Y %H:%M"))
+        content = content.replace("[TRAIN-NEXT]", f"{rng.randint(100, 99999):06d}")
+        content = content.replace("[TRAIN]", f"{rng.randint(100, 99999):06d}")
+
+        return self.renderLayout("D1320", content)
+
+    def renderTrainPage(self, trainNumber : str) -> str:
+        rng = random.Random(trainNumber)
+        stops = rng.sample(self.stations, rng.randint(4, 12))
+        planned = datetime.now(ZoneInfo('Europe/Berlin')).replace(tzinfo=None, second=0, microsecond=0) - timedelta(minutes=rng.randint(0, 240))
+        delay = rng.randint(0, 15)
+
+        rows = []
+        for index, station in enumerate(stops):
+            arrivalPlan = "" if index == 0 else planned.strftime("%H:%M")
+            arrivalActual = "" if index == 0 else (planned + timedelta(minutes=delay)).strftime("%H:%M")
+            departure = planned + timedelta(minutes=1 if 0 < index < len(stops) - 1 else 0)
+            departurePlan = "" if index == len(stops) - 1 else departure.strftime("%H:%M")
+            departureActual = "" if index == len(stops) - 1 else (departure + timedelta(minutes=delay)).strftime("%H:%M")
+
+            rows.append(f"{station:<28} {arrivalPlan:<11} {arrivalActual:<12} {departurePlan:<10} {departureActual:<11} {delay:+d}")
+
+            planned = departure + timedelta(minutes=rng.randint(5, 40))
+            delay = max(0, delay + rng.randint(-3, 4))
+
+        content = self.pages["D2040_route"]
+        content = content.replace("[FORM]", self.renderTrainForm(trainNumber))
+        content = content.replace("[NOW]", datetime.now(ZoneInfo('Europe/Berlin')).strftime("%d.%m.%Y %H:%M"))
+        content = content.replace("[TRAIN-QUERY]", trainNumber)
+        content = content.replace("[ROUTE-ROWS]", "\n".join(rows))
+
+        return self.renderLayout("D2040", content)
+
+    def formatUicNumber(self, locoNumber : str) -> str:
+        ## "925427491210" -> "92542 749121-0"
+        if len(locoNumber) == 12:
+            return f"{locoNumber[:5]} {locoNumber[5:11]}-{locoNumber[11]}"
+        elif len(locoNumber) == 7:
+            return f"92542 {locoNumber[:6]}-{locoNumber[6]}"
+        return f"92542 {locoNumber[:6].rjust(6, '0')}-0"
+
+class FakeIsorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" ## keep-alive like the real portal
+    disable_nagle_algorithm = True ## headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        return
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method : str):
+        fakeIsor : FakeIsorServer = self.server.fakeIsor
+        path = self.path.split("?")[0]
+        form = self.readForm() if method == "POST" else {}
+
+        fakeIsor.countRequest(method, path)
+
+        if fakeIsor.latency > 0:
+            time.sleep(fakeIsor.latency)
+
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        sessionId = cookie["ASP.NET_SessionId"].value if "ASP.NET_SessionId" in cookie else None
+        session = fakeIsor.getSession(sessionId)
+
+        if fakeIsor.errorRate > 0 and fakeIsor.random.random() < fakeIsor.errorRate:
+            self.respond(503, "<html><body><h1>Služba je dočasně nedostupná</h1></body></html>", session)
+            return
+
+        if path == "/Login/Login":
+            if method == "POST" and fakeIsor.login(session, form.get("jmeno", ""), form.get("heslo", "")):
+                self.redirect("/", session)
+            else:
+                self.respond(200, fakeIsor.renderLoginPage(), session)
+            return
+
+        if not session.authenticated:
+            self.redirect("/Login/Login", session)
+            return
+
+        if path == "/":
+            self.respond(200, fakeIsor.renderMainPage(), session)
+        elif path == "/Dotazy/D1320":
+            if method == "POST":
+                self.respond(200, fakeIsor.renderLocoPage(form.get("cisloLokomotivy", "")), session)
+            else:
+                self.respond(200, fakeIsor.renderLayout("D1320", fakeIsor.renderLocoForm()), session)
+        elif path == "/Dotazy/D2040":
+            if method == "POST":
+                self.respond(200, fakeIsor.renderTrainPage(form.get("cisloVlaku", "")), session)
+            else:
+                self.respond(200, fakeIsor.renderLayout("D2040", fakeIsor.renderTrainForm()), session)
+        else:
+            self.respond(404, "<html><body><h1>Stránka nenalezena</h1></body></html>", session)
+
+    def readForm(self) -> dict[str, str]:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8") if length > 0 else ""
+        return { key : values[0] for key, values in parse_qs(body, keep_blank_values=True).items() }
+
+    def redirect(self, location : str, session : FakeIsorSession):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.send_header("Set-Cookie", f"ASP.NET_SessionId={session.id}; path=/; HttpOnly")
+        self.end_headers()
+
+    def respond(self, status : int, html : str, session : FakeIsorSession):
+        body = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", f"ASP.NET_SessionId={session.id}; path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the ISOR portal")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with 503")
+    parser.add_argument("--session-lifetime", type=float, default=60 * 60, help="seconds until a login expires")
+    args = parser.parse_args()
+
+    server = FakeIsorServer(args.host, args.port, args.latency, args.error_rate, args.session_lifetime)
+    server.start()
+    print(f"Fake ISOR running at {server.baseUrl}, stop with Ctrl+C")
+
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
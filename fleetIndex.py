@@ -0,0 +1,185 @@
+import bisect
+import functools
+import threading
+from datetime import datetime, timedelta
+from locoHandler import LocoExportModel
+from keyIndex import KeyIndex, normalizeTrain, normalizeStation, normalizeText
+
+@functools.lru_cache(maxsize=4096)
+def parseLocoTime(text : str) -> datetime:
+    ## "21.09.2023 20:15", the same few times repeat on every render
+    return datetime.strptime(text, "%d.%m.%Y %H:%M")
+
+class FleetQuery:
+    ## Filter, sort and page of the fleet table, read from the query string of the index page
+    sorts = ["", "time", "position"]
+    states = ["", "hot", "cold"]
+
+    def __init__(self, station : str = "", function : str = "", train : str = "", color : str = "", state : str = "",
+                 sort : str = "", descending : bool = None, page : int = 1, pageSize : int = 100):
+        self.station = station
+        self.function = function
+        self.train = train
+        self.color = color
+        self.state = state if state in FleetQuery.states else ""
+        self.sort = sort if sort in FleetQuery.sorts else ""
+        self.descending = descending if descending is not None else self.sort == "time" ## the newest first by default
+        self.page = max(1, page)
+        self.pageSize = min(max(1, pageSize), 1000)
+
+    @staticmethod
+    def fromArgs(args) -> "FleetQuery":
+        order = args.get('order', "")
+        return FleetQuery(args.get('station', "").strip(), args.get('function', "").strip(), args.get('train', "").strip(),
+                          args.get('color', "").strip(), args.get('state', ""), args.get('sort', ""),
+                          (order == "desc") if order in ("asc", "desc") else None,
+                          args.get('page', 1, type=int), args.get('pageSize', 100, type=int))
+
+    @staticmethod
+    def isRequested(args) -> bool:
+        return any(name in args for name in ('station', 'function', 'train', 'color', 'state', 'sort', 'order', 'page', 'pageSize'))
+
+    def toArgs(self, page : int = None) -> dict:
+        args = { 'station' : self.station, 'function' : self.function, 'train' : self.train, 'color' : self.color, 'state' : self.state, 'sort' : self.sort }
+        args = { name : value for name, value in args.items() if value != "" }
+        if self.sort != "":
+            args['order'] = "desc" if self.descending else "asc"
+        args['page'] = page if page is not None else self.page
+        args['pageSize'] = self.pageSize
+        return args
+
+class FleetIndex:
+    ## Secondary indexes over the rows of the index page: value to full ids for the filters and
+    ## lists kept sorted by time and by position, so a filtered page is an intersection of sets
+    ## and a sorted page is a slice. Every row change updates only the entries of that row.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.rows : dict[str, LocoExportModel] = {} ## full id to row, in the order of the page
+
+        self.byStation = KeyIndex(normalizeStation)
+        self.byFunction = KeyIndex(normalizeText)
+        self.byTrain = KeyIndex(normalizeTrain) ## current and reserved train numbers
+        self.byColor = KeyIndex(normalizeText)
+        self.reserved : set[str] = set() ## rows with a reservation, those are hot whatever their time
+
+        self.byTime : list[tuple[datetime, str]] = [] ## sorted (time, full id), rows without a time are not in it
+        self.byPosition : list[tuple[str, str]] = [] ## sorted (station, full id)
+
+    def replaceAll(self, rows : list[LocoExportModel]):
+        with self.lock:
+            self.clear()
+            for row in rows:
+                self.link(row)
+
+    def update(self, row : LocoExportModel):
+        with self.lock:
+            previous = self.rows.get(row.fullId)
+            if previous is not None:
+                self.unlink(previous)
+            self.link(row)
+
+    def remove(self, fullId : str):
+        with self.lock:
+            previous = self.rows.pop(fullId, None)
+            if previous is not None:
+                self.unlink(previous)
+
+    def link(self, row : LocoExportModel):
+        self.rows[row.fullId] = row
+
+        self.byStation.add(row.place, row.fullId)
+        self.byFunction.add(row.function, row.fullId)
+        self.byTrain.add(row.trainNum, row.fullId)
+        self.byTrain.add(row.trainNumReservation, row.fullId)
+        self.byColor.add(row.color, row.fullId)
+
+        timeKey = self.timeKey(row)
+        if timeKey is not None:
+            bisect.insort(self.byTime, (timeKey, row.fullId))
+            if row.trainNumReservation != "---":
+                self.reserved.add(row.fullId)
+        bisect.insort(self.byPosition, (normalizeStation(row.place), row.fullId))
+
+    def unlink(self, row : LocoExportModel):
+        ## the row keeps its place in self.rows, link() puts the new version there
+        self.byStation.remove(row.place, row.fullId)
+        self.byFunction.remove(row.function, row.fullId)
+        self.byTrain.remove(row.trainNum, row.fullId)
+        self.byTrain.remove(row.trainNumReservation, row.fullId)
+        self.byColor.remove(row.color, row.fullId)
+
+        timeKey = self.timeKey(row)
+        if timeKey is not None:
+            self.removeSorted(self.byTime, (timeKey, row.fullId))
+        self.reserved.discard(row.fullId)
+        self.removeSorted(self.byPosition, (normalizeStation(row.place), row.fullId))
+
+    def query(self, query : FleetQuery, currentTime : datetime) -> tuple[int, list[LocoExportModel]]:
+        ## (number of matching rows, rows of the requested page)
+        with self.lock:
+            candidates = None
+            for index, value in ((self.byStation, query.station), (self.byFunction, query.function), (self.byTrain, query.train), (self.byColor, query.color)):
+                matching = index.find(value)
+                if matching is not None:
+                    candidates = matching if candidates is None else candidates & matching
+
+            if query.state != "":
+                hot = self.hotRows(currentTime)
+                if query.state == "hot":
+                    candidates = hot if candidates is None else candidates & hot
+                else:
+                    candidates = (self.rows.keys() - hot) if candidates is None else candidates - hot
+
+            ordered = self.order(query, candidates, currentTime)
+
+            start = (query.page - 1) * query.pageSize
+            return len(ordered), [self.rows[fullId] for fullId in ordered[start:start + query.pageSize]]
+
+    def order(self, query : FleetQuery, candidates : set[str], currentTime : datetime) -> list[str]:
+        if query.sort == "time":
+            ## rows without a time are the oldest ones
+            timed = [fullId for _, fullId in self.byTime if candidates is None or fullId in candidates]
+            untimed = [fullId for fullId in self.rows if (candidates is None or fullId in candidates) and self.timeKey(self.rows[fullId]) is None]
+            ordered = untimed + timed
+        elif query.sort == "position":
+            ordered = [fullId for _, fullId in self.byPosition if candidates is None or fullId in candidates]
+        else:
+            ## as on the index page: hot rows first, then the cold ones, each in the page order
+            hot = self.hotRows(currentTime)
+            rows = [fullId for fullId in self.rows if candidates is None or fullId in candidates]
+            return [fullId for fullId in rows if fullId in hot] + [fullId for fullId in rows if fullId not in hot]
+
+        if query.descending:
+            ordered.reverse()
+        return ordered
+
+    def hotRows(self, currentTime : datetime) -> set[str]:
+        ## a reservation or a move in the last 24h, the same rule as the index page
+        since = currentTime.replace(tzinfo=None) - timedelta(hours=24)
+        start = bisect.bisect_left(self.byTime, (since, ""))
+        return self.reserved | { fullId for _, fullId in self.byTime[start:] }
+
+    def getChoices(self) -> tuple[list[str], list[str]]:
+        ## (functions, colours) shown on the page, to offer them in the filter
+        with self.lock:
+            functions = sorted({ row.function for row in self.rows.values() if row.function != "" })
+            colors = sorted({ row.color for row in self.rows.values() if row.color })
+            return functions, colors
+
+    @staticmethod
+    def timeKey(row : LocoExportModel) -> datetime:
+        if row.time is None or row.time == "":
+            return None
+        try:
+            return parseLocoTime(row.time)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def removeSorted(values : list, value):
+        position = bisect.bisect_left(values, value)
+        if position < len(values) and values[position] == value:
+            del values[position]
@@ -0,0 +1,195 @@
+import time
+import sqlite3
+import threading
+from zoneinfo import ZoneInfo
+from datetime import datetime
+from flask import Flask
+from locoHandler import LocoExportModel
+
+class HistoryEntry:
+    def __init__(self, fullId : str, fetchedAt : float, positionAt : float, place : str, time : str, function : str, trainNum : str, trainNumReservation : str):
+        self.fullId = fullId
+        self.fetchedAt = fetchedAt ## when this position was first seen
+        self.positionAt = positionAt ## the ISOR time of the position as a timestamp, None when unknown
+        self.place = place
+        self.time = time
+        self.function = function
+        self.trainNum = trainNum
+        self.trainNumReservation = trainNumReservation
+
+    def toDict(self) -> dict:
+        return {
+            'fullId' : self.fullId,
+            'fetchedAt' : self.fetchedAt,
+            'positionAt' : self.positionAt,
+            'place' : self.place,
+            'time' : self.time,
+            'function' : self.function,
+            'trainNum' : self.trainNum,
+            'trainNumReservation' : self.trainNumReservation,
+        }
+
+class HistoryStore:
+    ## Append-only SQLite history of the dumped positions. A row is written only when the
+    ## loco shows something else than in its previous row, so parked locos cost nothing.
+    ## Rows are buffered and written in one transaction per batch, rows older than the
+    ## retention are deleted once a day.
+    def __init__(self, path : str, logger : Flask.logger = None, retentionDays : float = 90, batchSize : int = 200, flushInterval : float = 5):
+        self._logger = logger
+        self.path = path
+
+        self.retentionDays = retentionDays
+        self.compactionInterval = 24 * 3600
+        self.lastCompaction = 0
+
+        ## batching
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval ## seconds a row may wait in the buffer
+        self.pending : list[tuple] = []
+        self.pendingValues : dict[str, tuple] = {} ## the latest buffered row of every loco
+        self.maxPending = 50 * batchSize ## a failing database keeps at most this many rows for a retry
+        self.lastFlush = time.time()
+
+        ## one connection shared by all threads, the lock keeps them from interleaving
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.createSchema()
+
+        ## the latest written row of every loco, so unchanged positions are not written again
+        self.lastRecorded : dict[str, tuple] = self.loadLastRecorded()
+
+        ## counters
+        self.rowsWritten = 0
+        self.rowsSkipped = 0
+        self.rowsDeleted = 0
+
+    def createSchema(self):
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS positions (
+                fullId TEXT NOT NULL,
+                fetchedAt REAL NOT NULL,
+                positionAt REAL,
+                place TEXT NOT NULL,
+                time TEXT NOT NULL,
+                function TEXT NOT NULL,
+                trainNum TEXT NOT NULL,
+                trainNumReservation TEXT NOT NULL)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS positionsByLoco ON positions (fullId, fetchedAt)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS positionsByPlace ON positions (place, fetchedAt)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS positionsByTime ON positions (fetchedAt)")
+
+    def loadLastRecorded(self) -> dict[str, tuple]:
+        with self.lock:
+            rows = self.connection.execute("""SELECT fullId, place, time, function, trainNum, trainNumReservation, MAX(fetchedAt)
+                FROM positions GROUP BY fullId""").fetchall()
+        return { row[0] : tuple(row[1:6]) for row in rows }
+
+    def record(self, exportModel : LocoExportModel):
+        ## only answered requests with a position are history
+        if exportModel.fetchedAt is None or exportModel.place == "":
+            return
+
+        values = (exportModel.place, exportModel.time, exportModel.function, exportModel.trainNum, exportModel.trainNumReservation)
+
+        with self.lock:
+            latest = self.pendingValues.get(exportModel.fullId, self.lastRecorded.get(exportModel.fullId))
+            if latest == values:
+                self.rowsSkipped += 1
+                return
+
+            self.pendingValues[exportModel.fullId] = values
+            self.pending.append((exportModel.fullId, exportModel.fetchedAt, self.parsePositionTime(exportModel.time)) + values)
+
+            due = len(self.pending) >= self.batchSize or time.time() - self.lastFlush >= self.flushInterval
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.lastFlush = time.time()
+            if len(self.pending) == 0:
+                return
+
+            batch = self.pending
+            self.pending = []
+
+            try:
+                with self.connection:
+                    self.connection.executemany("INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            except sqlite3.Error as e: ## a failed batch must not break the refresh, it is written with the next one
+                self.pending = batch[-self.maxPending:]
+                if len(self.pending) < len(batch):
+                    self.pendingValues = { row[0] : row[3:] for row in self.pending }
+                if self._logger is not None:
+                    self._logger.warning(f"Couldn't write {len(batch)} history rows, keeping {len(self.pending)} for a retry: {e}")
+                return
+
+            ## only committed rows count as recorded
+            self.lastRecorded.update(self.pendingValues)
+            self.pendingValues = {}
+            self.rowsWritten += len(batch)
+
+        if time.time() - self.lastCompaction >= self.compactionInterval:
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            self.lastCompaction = time.time()
+            try:
+                with self.connection:
+                    deleted = self.connection.execute("DELETE FROM positions WHERE fetchedAt < ?", (time.time() - self.retentionDays * 24 * 3600,)).rowcount
+            except sqlite3.Error as e:
+                if self._logger is not None:
+                    self._logger.warning(f"Couldn't delete old history rows: {e}")
+                return
+            self.rowsDeleted += deleted
+
+        if deleted > 0 and self._logger is not None:
+            self._logger.info(f"Deleted {deleted} history rows older than {self.retentionDays} days")
+
+    def getTimeline(self, fullId : str, since : float = None, until : float = None, limit : int = 500) -> list[HistoryEntry]:
+        ## positions of one loco, the newest first
+        return self.query("fullId = ?", (fullId,), since, until, limit)
+
+    def getPlaceHistory(self, place : str, since : float = None, until : float = None, limit : int = 500) -> list[HistoryEntry]:
+        ## locos seen at the place, the newest first
+        return self.query("place = ?", (place,), since, until, limit)
+
+    def getPositionAt(self, fullId : str, when : float) -> HistoryEntry:
+        ## the position the loco had at the given time, None when it is older than the history
+        entries = self.query("fullId = ?", (fullId,), None, when, 1)
+        return entries[0] if len(entries) > 0 else None
+
+    def query(self, condition : str, parameters : tuple, since : float, until : float, limit : int) -> list[HistoryEntry]:
+        ## rows still in the buffer are written first, so the answer includes them
+        self.flush()
+
+        if since is not None:
+            condition += " AND fetchedAt >= ?"
+            parameters += (since,)
+        if until is not None:
+            condition += " AND fetchedAt <= ?"
+            parameters += (until,)
+
+        with self.lock:
+            rows = self.connection.execute(f"""SELECT fullId, fetchedAt, positionAt, place, time, function, trainNum, trainNumReservation
+                FROM positions WHERE {condition} ORDER BY fetchedAt DESC LIMIT ?""", parameters + (limit,)).fetchall()
+
+        return [HistoryEntry(*row) for row in rows]
+
+    def parsePositionTime(self, positionTime : str) -> float:
+        try:
+            return datetime.strptime(positionTime, "%d.%m.%Y %H:%M").replace(tzinfo=ZoneInfo('Europe/Berlin')).timestamp()
+        except ValueError:
+            return None
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return { 'rowsWritten' : self.rowsWritten, 'rowsSkipped' : self.rowsSkipped, 'rowsDeleted' : self.rowsDeleted, 'pending' : len(self.pending) }
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
@@ -1,11 +1,82 @@
 import time
+import uuid
 import requests
-import queue
+import threading
+import concurrent.futures
+from collections import deque
+from requests.adapters import HTTPAdapter
 from flask import Flask
-from isorDataTypes import IsorRequest, IsorResponse
+from isorDataTypes import IsorRequest, IsorResponse, RequestPriority
+from rateLimiter import AdaptiveRateLimiter
+
+class InFlightRequest:
+    ## one upstream request shared by every caller asking for the same url and body
+    def __init__(self, request : IsorRequest):
+        self.request = request
+        self.followers : list[concurrent.futures.Future] = []
+
+    def abandoned(self) -> bool:
+        return all(follower.cancelled() for follower in self.followers)
+
+class PriorityRequestQueue:
+    ## Serves the highest priority first, but a waiting lower class is served
+    ## after being passed over fairnessBurst times, so bulk work still completes.
+    def __init__(self, fairnessBurst : int = 8):
+        self.fairnessBurst = fairnessBurst
+        self.queues = { priority : deque() for priority in RequestPriority }
+        self.passedOver = { priority : 0 for priority in RequestPriority }
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, request : IsorRequest):
+        with self.condition:
+            if request is None: ## stop sentinel
+                self.closed = True
+            else:
+                self.queues[request.priority].append(request)
+            self.condition.notify()
+
+    def get(self) -> IsorRequest:
+        with self.condition:
+            self.condition.wait_for(lambda: self.closed or self.qsize() > 0)
+
+            if self.closed:
+                return None
+
+            waiting = [priority for priority in RequestPriority if self.queues[priority]]
+
+            chosen = waiting[0]
+            for priority in waiting[1:]:
+                if self.passedOver[priority] >= self.fairnessBurst:
+                    chosen = priority
+                    break
+
+            for priority in waiting:
+                if priority == chosen:
+                    self.passedOver[priority] = 0
+                elif priority > chosen:
+                    self.passedOver[priority] += 1
+
+            return self.queues[chosen].popleft()
+
+    def promote(self, request : IsorRequest, priority : RequestPriority):
+        ## move a still queued request to a more urgent class
+        with self.condition:
+            if priority >= request.priority or request not in self.queues[request.priority]:
+                return
+            self.queues[request.priority].remove(request)
+            request.priority = priority
+            self.queues[priority].append(request)
+
+    def qsize(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
 
 class IsorClient:
-    def __init__(self, logger : Flask.logger, username : str, password : str):
+    def __init__(self, logger : Flask.logger, username : str, password : str, poolSize : int = 4, connectTimeout : float = 5, readTimeout : float = 30,
+                 baseUrl : str = "https://isor.spravazeleznic.cz", rateLimiter : AdaptiveRateLimiter = None):
         self.logger = logger
 
         ## credentials
@@ -13,70 +84,246 @@ class IsorClient:
         self.password = password
 
         ## urls
-        self.url_login = "https://isor.spravazeleznic.cz/Login/Login"
-        self.url_request_loco = "https://isor.spravazeleznic.cz/Dotazy/D1320"
-        self.url_request_train = "https://isor.spravazeleznic.cz/Dotazy/D2040"
-        self.url_mainpage = "https://isor.spravazeleznic.cz/"
+        self.baseUrl = baseUrl.rstrip("/")
+        self.url_login = f"{self.baseUrl}/Login/Login"
+        self.url_request_loco = f"{self.baseUrl}/Dotazy/D1320"
+        self.url_request_train = f"{self.baseUrl}/Dotazy/D2040"
+        self.url_mainpage = f"{self.baseUrl}/"
 
-        ## request delay
+        ## request delay, adapting to how the portal copes
         self.lastRequest = time.time()
-        self.requestDelay = 0.5
+        self.rateLimiter = rateLimiter if rateLimiter is not None else AdaptiveRateLimiter()
         self.lastRequestUrl = ""
 
         ## session cookies
         self.logged = False
-        self.sessionCookies = None
         self.loginTimeOut = 60 * 60 ## 1 hour
+        self.loginFormMarkers = ('name="jmeno"', 'name="heslo"')
 
-        ## requests queue
-        self.requestQueue = queue.Queue()
-        self.responseDict = {}
+        ## session counters
+        self.probesAvoided = 0
+        self.reloginCount = 0
+        self.coalescedCount = 0
+
+        ## one pooled keep-alive session, its cookie jar holds the ISOR login
+        self.timeout = (connectTimeout, readTimeout)
+        self.session = self.createSession(poolSize)
+
+        ## requests queue, every caller has its future keyed by guid,
+        ## identical requests in flight share one upstream request keyed by (url, body)
+        self.requestQueue = PriorityRequestQueue()
+        self.pendingFutures : dict[uuid.UUID, concurrent.futures.Future] = {}
+        self.inFlightRequests : dict[tuple, InFlightRequest] = {}
+        self.futuresLock = threading.Lock()
+        self.stopEvent = threading.Event()
 
         self.loginToISOR()
 
-    def GetResponse(self, request : IsorRequest) -> IsorResponse:
-        self.requestQueue.put(request)
+    def GetResponse(self, request : IsorRequest, timeout : float = None) -> IsorResponse:
+        return self.Submit(request).result(timeout)
+
+    def Submit(self, request : IsorRequest) -> concurrent.futures.Future:
+        ## enqueue the request and return immediately, the future resolves to IsorResponse
+        future = concurrent.futures.Future()
+        key = self.requestKey(request)
+
+        with self.futuresLock:
+            self.pendingFutures[request.guid] = future
+
+            inFlight = self.inFlightRequests.get(key)
+            isLeader = inFlight is None
+            if isLeader:
+                inFlight = InFlightRequest(request)
+                self.inFlightRequests[key] = inFlight
+            else:
+                self.coalescedCount += 1
+
+            inFlight.followers.append(future)
+
+        future.add_done_callback(lambda _: self.forgetFuture(request.guid))
+
+        if isLeader:
+            self.requestQueue.put(request)
+        else:
+            self.logger.debug(f"Request {request.guid} attached to in-flight request {inFlight.request.guid}")
+            self.requestQueue.promote(inFlight.request, request.priority)
+
+        return future
 
-        while request.guid not in self.responseDict:
-            pass
-        
-        return self.responseDict.pop(request.guid)
+    def SubmitMany(self, isorRequests : list[IsorRequest]) -> list[concurrent.futures.Future]:
+        return [self.Submit(request) for request in isorRequests]
+
+    def AsCompleted(self, futures : list[concurrent.futures.Future], timeout : float = None):
+        ## yields the futures in the order their responses arrive
+        return concurrent.futures.as_completed(futures, timeout)
+
+    def GetFuture(self, guid : uuid.UUID) -> concurrent.futures.Future:
+        with self.futuresLock:
+            return self.pendingFutures.get(guid)
+
+    def Cancel(self, guid : uuid.UUID) -> bool:
+        ## detaches the caller, the upstream request is dropped once nobody waits for it
+        future = self.GetFuture(guid)
+        if future is None:
+            return False
+        return future.cancel()
+
+    def forgetFuture(self, guid : uuid.UUID):
+        with self.futuresLock:
+            self.pendingFutures.pop(guid, None)
+
+    def requestKey(self, request : IsorRequest) -> tuple:
+        return (request.url, tuple(sorted(request.body.items())))
+
+    def dropIfAbandoned(self, request : IsorRequest) -> bool:
+        ## decided and dropped under one lock, a Submit coalescing meanwhile keeps the request alive
+        key = self.requestKey(request)
+        with self.futuresLock:
+            inFlight = self.inFlightRequests.get(key)
+            if inFlight is not None and inFlight.request is not request:
+                return True ## a newer request for the same key is queued and serves its followers
+            if inFlight is not None and not inFlight.abandoned():
+                return False
+            self.inFlightRequests.pop(key, None)
+            return True
+
+    def finishInFlight(self, request : IsorRequest, response : IsorResponse = None, error : Exception = None):
+        ## every follower gets the response or the error, never a missing response
+        if response is None and error is None:
+            error = Exception(f"Request {request.guid} got no response")
+
+        key = self.requestKey(request)
+        with self.futuresLock:
+            inFlight = self.inFlightRequests.get(key)
+            if inFlight is None or inFlight.request is not request:
+                return
+            del self.inFlightRequests[key]
+
+        for follower in inFlight.followers:
+            try:
+                if error is not None:
+                    follower.set_exception(error)
+                else:
+                    follower.set_result(response)
+            except concurrent.futures.InvalidStateError: ## cancelled by its caller
+                pass
     
     def RequestHandler(self):
-        while True:
-            if (time.time() - self.lastRequest) > self.requestDelay and not self.requestQueue.empty():
-                request = self.requestQueue.get()
-                
-                self.logger.debug(f"Handling request {request.guid}...")
+        while not self.stopEvent.is_set():
+            ## blocks until there is something to do, no polling
+            request = self.requestQueue.get()
+
+            if request is None: ## sentinel put by Stop()
+                break
+
+            ## skip requests whose callers all cancelled them meanwhile
+            if self.dropIfAbandoned(request):
+                self.logger.debug(f"Request {request.guid} cancelled, skipping...")
+                continue
 
+            ## keep the gap between two requests, sleeping instead of spinning
+            if not self.rateLimiter.acquire(self.stopEvent):
+                self.finishInFlight(request, error=Exception("IsorClient stopped"))
+                break
 
+            self.logger.debug(f"Handling request {request.guid}...")
+
+            try:
+                ## the login is not probed up front anymore, an expired session shows up in the response itself
                 if (self.lastRequestUrl != request.url or (time.time() - self.lastRequest) > self.loginTimeOut):
-                    self.checkLogOn(request.url)
+                    self.probesAvoided += 1
+
+                response = self.sendRequest(request)
 
-                rawResponse = requests.post(request.url, data = request.body, cookies=self.sessionCookies)
+                if self.sessionExpired(response):
+                    self.rateLimiter.record(response.elapsed, response.status, sessionExpired=True)
+
+                    self.logger.debug(f"Session expired while handling {request.guid}, logging in again and replaying...")
+
+                    self.reloginCount += 1
+                    self.loginToISOR()
+
+                    response = self.sendRequest(request)
+
+                    if self.sessionExpired(response):
+                        raise Exception("Failed to log in to ISOR!")
+
+                self.rateLimiter.record(response.elapsed, response.status)
 
                 self.lastRequestUrl = request.url
 
+                self.finishInFlight(request, response)
+
+                self.logger.debug(f"Request {request.guid} handled!")
+            except Exception as e:
+                self.logger.warning(f"Request {request.guid} failed: {e}")
+
+                self.rateLimiter.recordFailure()
+
+                self.finishInFlight(request, error=e)
+            finally:
                 self.lastRequest = time.time()
 
-                response = IsorResponse(rawResponse.status_code, rawResponse.text, request.guid)
+    def Stop(self):
+        self.stopEvent.set()
+        self.requestQueue.put(None)
 
-                self.responseDict[request.guid] = response
+        ## nothing will serve the remaining requests anymore
+        with self.futuresLock:
+            pending = list(self.pendingFutures.values())
+        for future in pending:
+            future.cancel()
 
-                self.logger.debug(f"Request {request.guid} handled!")
+    def sendRequest(self, request : IsorRequest) -> IsorResponse:
+        rawResponse = self.session.post(request.url, data = request.body, timeout=self.timeout)
 
-                self.requestQueue.task_done()
+        response = IsorResponse(rawResponse.status_code, rawResponse.text, request.guid, rawResponse.url)
+        response.elapsed = rawResponse.elapsed.total_seconds()
+        return response
+
+    def sessionExpired(self, response : IsorResponse) -> bool:
+        ## ISOR redirects requests without a valid session to the login form
+        if response.url.startswith(self.url_login):
+            return True
+        return all(marker in response.text for marker in self.loginFormMarkers)
+
+    def getSessionStats(self) -> dict:
+        return { 'probesAvoided' : self.probesAvoided, 'relogins' : self.reloginCount, 'coalesced' : self.coalescedCount }
+
+    def createSession(self, poolSize : int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        return session
+
+    def getConnectionStats(self) -> dict:
+        ## urllib3 counts opened connections and sent requests per host pool
+        opened = 0
+        sent = 0
+        ## the same adapter is mounted for both schemes
+        for adapter in {id(adapter) : adapter for adapter in self.session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                opened += pool.num_connections
+                sent += pool.num_requests
+
+        return { 'connectionsOpened' : opened, 'requestsSent' : sent, 'connectionsReused' : max(0, sent - opened) }
 
     def loginToISOR(self):
         self.logger.info("Trying to log in to ISOR...")
 
-        ## make simple GET request to obtain any sessionId
-        cookieGetter = requests.get(self.url_login)
-        self.sessionCookies = cookieGetter.cookies
+        ## drop the expired session and make simple GET request to obtain any sessionId
+        self.session.cookies.clear()
+        self.session.get(self.url_login, timeout=self.timeout)
 
         ## validate the sessionCookie with correct username and password
         loginPayload = {'jmeno': self.username, 'heslo': self.password}
-        validation = requests.post(self.url_login, data = loginPayload, cookies=self.sessionCookies)
+        validation = self.session.post(self.url_login, data = loginPayload, timeout=self.timeout)
 
         ## check if we are logged in
         if self.requestPageAvailable(self.url_request_loco) and validation.status_code == 200:
@@ -94,27 +341,12 @@ class IsorClient:
 
             raise Exception("Failed to log in to ISOR!")
 
-    def checkLogOn(self, page):
-        self.logger.debug("Checking if logged into ISOR...")
-
-        if not self.requestPageAvailable(page):
-
-            self.logger.debug("Not logged in to ISOR, trying to log in again...")
-
-            result = self.loginToISOR()
-
-            if not result:
-
-                self.logger.debug("Failed to log again in to ISOR!")
-
-                raise Exception("Failed to log in to ISOR!")
-
     def requestPageAvailable(self, page):
         self.logger.debug(f"Trying to open {page} to check if logged in...")
 
         ## If we open (locked) request page and the request page is returned, we are logged in
 
-        logOnTestRequest = requests.get(page, cookies=self.sessionCookies)
+        logOnTestRequest = self.session.get(page, timeout=self.timeout)
         openedPage = logOnTestRequest.url
 
         self.logger.debug(f"Page {openedPage} openned, expected {page}...")
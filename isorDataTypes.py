@@ -1,13 +1,22 @@
 import uuid
+from enum import IntEnum
+
+class RequestPriority(IntEnum):
+    INTERACTIVE = 0 ## somebody is waiting for the page
+    BULK = 1 ## whole table refresh
+    PREFETCH = 2 ## nobody asked yet
 
 class IsorRequest:
-    def __init__(self, url : str, body : dict):
+    def __init__(self, url : str, body : dict, priority : RequestPriority = RequestPriority.INTERACTIVE):
         self.url = url
         self.body = body
+        self.priority = priority
         self.guid = uuid.uuid4()
 
 class IsorResponse:
-    def __init__(self, status : int, text : str, guid : uuid):
+    def __init__(self, status : int, text : str, guid : uuid, url : str = ""):
         self.status = status
         self.text = text
-        self.guid = guid
\ No newline at end of file
+        self.guid = guid
+        self.url = url ## final url after redirects
+        self.elapsed = 0 ## seconds the portal took to answer
\ No newline at end of file
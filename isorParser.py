@@ -0,0 +1,211 @@
+import re
+import hashlib
+from itertools import islice
+from locoHandler import LocoExportModel
+
+## D1320 patterns, compiled once for all pages
+## a current performance row: "1322 +Praha hl.n.   21.09.2023 20:15 012345 1. vlakové HV ..."
+currentRowPattern = re.compile(r"(\d\d\d\d) ([+|-]\D*) (\d\d.\d\d.\d\d\d\d \d\d:\d\d) (\d\d\d\d\d\d) (\d.\D*)")
+## the last known position row: "92542 749121-0  Praha-Libeň  +Praha hl.n.   21.09.2023 20:15"
+lastPositionPattern = re.compile(r"(\d\d\d\d\d \d\d\d\d\d\d-\d  \D*[\+\-]?.*\d\d.\d\d.\d\d\d\d \d\d:\d\d)")
+datePattern = re.compile(r"\d\d.\d\d.\d\d\d\d \d\d:\d\d")
+functionPattern = re.compile(r"\d\. [\D]* HV")
+trainNumberPattern = re.compile(r" \d\d\d\d\d\d ")
+
+reservationHeadingText = "stanice zahájení     funkce               vlak   stanice cílová/odst  stanice zahájení     funkce               vlak   stanice cílová/odst"
+
+class LocoPageResult:
+    def __init__(self):
+        ## current performance of the loco
+        self.hasCurrentPosition = False
+        self.currentPlace = ""
+        self.currentTime = ""
+        self.function = ""
+        self.trainNum = "---"
+
+        ## last known position, only looked up when there is no current one
+        self.hasLastKnownPosition = False
+        self.lastKnownPlace = ""
+        self.lastKnownTime = ""
+
+        ## the first two reserved train numbers, that is all the table shows
+        self.hasReservations = False
+        self.reservationTrainNums : list[str] = []
+
+    @property
+    def place(self) -> str:
+        return self.currentPlace if self.hasCurrentPosition else self.lastKnownPlace
+
+    @property
+    def time(self) -> str:
+        return self.currentTime if self.hasCurrentPosition else self.lastKnownTime
+
+    def nextReservation(self) -> str:
+        ## usually the first reservation is for the current train, then the second one is the next
+        for trainNum in self.reservationTrainNums:
+            if trainNum != self.trainNum:
+                return trainNum
+        return "---"
+
+    def applyTo(self, exportModel : LocoExportModel) -> LocoExportModel:
+        if not self.hasCurrentPosition and not self.hasLastKnownPosition:
+            return exportModel
+
+        exportModel.function = self.function
+        exportModel.trainNum = self.trainNum
+        exportModel.place = self.place
+        exportModel.time = self.time
+
+        if self.hasReservations:
+            exportModel.trainNumReservation = self.nextReservation()
+
+        return exportModel
+
+class LocoPageParser:
+    ## Parses a D1320 response: the <pre> block is cut out once and every pattern runs only over it
+    def parse(self, html : str) -> LocoPageResult:
+        result = LocoPageResult()
+        block = self.isolatePre(html)
+
+        currentRow = currentRowPattern.search(block)
+        if currentRow is not None:
+            result.hasCurrentPosition = True
+            result.currentPlace = currentRow.group(2).strip()
+            result.currentTime = currentRow.group(3)
+            result.trainNum = currentRow.group(4).lstrip('0')
+
+            functionMatch = functionPattern.search(currentRow.group(5))
+            if functionMatch is not None:
+                result.function = functionMatch.group(0).strip()
+        else:
+            self.parseLastKnownPosition(block, result)
+
+            if not result.hasLastKnownPosition:
+                return result
+
+        headingIndex = block.find(reservationHeadingText)
+        if headingIndex >= 0:
+            result.hasReservations = True
+            result.reservationTrainNums = [match.group(0).strip().lstrip('0') for match in islice(trainNumberPattern.finditer(block, headingIndex), 2)]
+
+        return result
+
+    def parseLastKnownPosition(self, block : str, result : LocoPageResult):
+        positionMatch = lastPositionPattern.search(block)
+        if positionMatch is None:
+            return
+
+        row = positionMatch.group(0)
+        dateMatch = datePattern.search(row)
+        if dateMatch is None:
+            return
+
+        ## remove the loconumber ("91547 380004-2") and the datum at the end
+        position = row.strip()[14:-len(dateMatch.group(0))].strip()
+
+        if ' +' in position:
+            place = f"+{position.split(' +')[1].strip()}"
+        elif ' -' in position:
+            place = f"-{position.split(' -')[1].strip()}"
+        else: ## no + or - in the string
+            parts = list(filter(None, position.split("  ")))
+            if len(parts) < 2:
+                return
+            place = parts[1].strip()
+
+        result.hasLastKnownPosition = True
+        result.lastKnownPlace = place
+        result.lastKnownTime = dateMatch.group(0)
+
+    def fingerprint(self, html : str) -> bytes:
+        ## digest of the <pre> block without its first line, which only carries the time of the query
+        block = self.isolatePre(html)
+        firstLineEnd = block.find("\n", block.find("\n") + 1)
+        if firstLineEnd >= 0:
+            block = block[firstLineEnd:]
+        return hashlib.blake2b(block.encode("utf-8"), digest_size=16).digest()
+
+    def isolatePre(self, html : str) -> str:
+        start = html.find("<pre>")
+        end = html.rfind("</pre>")
+        if start < 0 or end < start:
+            return html
+        return html[start:end]
+
+## D2040 route table, columns are found by their headings
+routeColumnHeadings = ["Příj. plán", "Příj. skut.", "Odj. plán", "Odj. skut.", "Zpoždění"]
+delayPattern = re.compile(r"[+-]?\d+")
+
+class RouteStop:
+    def __init__(self, station : str, arrivalPlanned : str, arrivalActual : str, departurePlanned : str, departureActual : str, delay : int):
+        self.station = station
+        self.arrivalPlanned = arrivalPlanned
+        self.arrivalActual = arrivalActual
+        self.departurePlanned = departurePlanned
+        self.departureActual = departureActual
+        self.delay = delay ## minutes, None when unknown
+
+    def toDict(self) -> dict:
+        return {
+            'station' : self.station,
+            'arrivalPlanned' : self.arrivalPlanned,
+            'arrivalActual' : self.arrivalActual,
+            'departurePlanned' : self.departurePlanned,
+            'departureActual' : self.departureActual,
+            'delay' : self.delay,
+        }
+
+class RouteResult:
+    def __init__(self, trainNumber : str, stops : list[RouteStop], raw : str):
+        self.trainNumber = trainNumber
+        self.stops = stops
+        self.raw = raw ## the <pre> block, shown as is when the table could not be read
+
+    def toDict(self) -> dict:
+        return { 'trainNumber' : self.trainNumber, 'stops' : [stop.toDict() for stop in self.stops] }
+
+class RoutePageParser:
+    ## Parses a D2040 response line by line, in time linear to the page size
+    def __init__(self, maxStops : int = 5000):
+        self.maxStops = maxStops
+
+    def parse(self, html : str, trainNumber : str = "") -> RouteResult:
+        start = html.find("<pre>")
+        end = html.find("</pre>", start)
+        if start < 0 or end < 0:
+            return None
+
+        raw = html[start:end + len("</pre>")]
+        lines = html[start + len("<pre>"):end].split("\n")
+
+        columns = None
+        stops = []
+        for line in lines:
+            if columns is None:
+                columns = self.findColumns(line)
+                continue
+
+            if line.strip() == "":
+                continue
+
+            stops.append(self.parseStop(line, columns))
+            if len(stops) >= self.maxStops:
+                break
+
+        return RouteResult(trainNumber, stops, raw)
+
+    def findColumns(self, line : str) -> list[int]:
+        ## start of every column on the heading line, None when this is not the heading
+        columns = [line.find(heading) for heading in routeColumnHeadings]
+        if min(columns) < 0:
+            return None
+        return columns
+
+    def parseStop(self, line : str, columns : list[int]) -> RouteStop:
+        bounds = [0] + columns + [len(line)]
+        cells = [line[bounds[index]:bounds[index + 1]].strip() for index in range(len(bounds) - 1)]
+
+        delayMatch = delayPattern.search(cells[5])
+        delay = int(delayMatch.group(0)) if delayMatch is not None else None
+
+        return RouteStop(cells[0], cells[1], cells[2], cells[3], cells[4], delay)
@@ -0,0 +1,50 @@
+def normalizeTrain(train : str) -> str:
+    ## "---" is the placeholder of no train
+    if train is None or train == "---":
+        return ""
+    return train.strip().lstrip('0')
+
+def normalizeStation(place : str) -> str:
+    ## "+Praha hl.n." and "-Praha hl.n." are both at Praha hl.n.
+    return normalizeText(place).lstrip("+-").strip()
+
+def normalizeText(text : str) -> str:
+    return text.strip().casefold() if text else ""
+
+class KeyIndex:
+    ## A value of the locos, normalized by normalizeKey, to the full ids of the locos having it.
+    ## Values that normalize to "" are not indexed, and as a filter they mean no filter.
+    def __init__(self, normalizeKey):
+        self.normalizeKey = normalizeKey
+        self.fullIds : dict[str, set[str]] = {}
+
+    def add(self, value : str, fullId : str):
+        key = self.normalizeKey(value)
+        if key == "":
+            return
+        self.fullIds.setdefault(key, set()).add(fullId)
+
+    def remove(self, value : str, fullId : str):
+        key = self.normalizeKey(value)
+        fullIds = self.fullIds.get(key)
+        if fullIds is None:
+            return
+        fullIds.discard(fullId)
+        if len(fullIds) == 0:
+            del self.fullIds[key]
+
+    def get(self, value : str) -> set[str]:
+        return self.fullIds.get(self.normalizeKey(value), set())
+
+    def find(self, value : str) -> set[str]:
+        ## the matching full ids, None when the value filters nothing
+        key = self.normalizeKey(value)
+        if key == "":
+            return None
+        return self.fullIds.get(key, set())
+
+    def clear(self):
+        self.fullIds = {}
+
+    def __len__(self) -> int:
+        return len(self.fullIds)
@@ -1,10 +1,9 @@
 import json
 from datetime import datetime
 from flask import Flask
-from dataclasses import dataclass
 
-@dataclass
 class Loco:
+    ## compared by identity, two locos may share the short number
     def __init__(self, shortNumber, fullNumber, note , editor, color = ""):
         self.number = shortNumber
         self.note = note
@@ -13,7 +12,7 @@ class Loco:
         self.color = color
 
 class LocoExportModel:
-    def __init__(self, id, fullId, color, function="", trainNum="---", trainNumReservation="---", place="", time=""):
+    def __init__(self, id, fullId, color, function="", trainNum="---", trainNumReservation="---", place="", time="", fetchedAt=None):
         self.id = id
         self.fullId = fullId
         self.color = color
@@ -22,19 +21,77 @@ class LocoExportModel:
         self.trainNumReservation = trainNumReservation
         self.place = place
         self.time = time
+        self.fetchedAt = fetchedAt ## when ISOR answered, None if it did not
+
+    def toDict(self) -> dict:
+        return {
+            'id' : self.id,
+            'fullId' : self.fullId,
+            'color' : self.color,
+            'function' : self.function,
+            'trainNum' : self.trainNum,
+            'trainNumReservation' : self.trainNumReservation,
+            'place' : self.place,
+            'time' : self.time,
+            'fetchedAt' : self.fetchedAt,
+        }
+
+    @staticmethod
+    def fromDict(data : dict) -> "LocoExportModel":
+        return LocoExportModel(data['id'], data['fullId'], data['color'], data['function'], data['trainNum'], data['trainNumReservation'],
+                               data['place'], data['time'], data['fetchedAt'])
 
 class LocoListHandler:
+    ## The fleet is kept in hash indexes by full and by short number, colours in a map from
+    ## the loco number to its colour, so lookups, adding and removing do not scan the list.
     def __init__(self, path : str, colorPath : str, logger : Flask.logger = None):
         self._logger = logger
         self.dataConfigPath = path
-        self.locoList : list[Loco] = self.deserialize()
+
+        self.locosByFullNumber : dict[str, Loco] = {}
+        self.locosByNumber : dict[str, list[Loco]] = {} ## short numbers are not unique across countries
+        self.sortedList : list[Loco] = None ## locoList, made again after a change
+        self.version = 0 ## raised on every change of the fleet
+
+        self.deserialize()
         self.colorList = self.deserializeColors(colorPath)
-        
+        self.colorByNumber : dict[str, str] = self.invertColors(self.colorList)
+
+    @property
+    def locoList(self) -> list[Loco]:
+        ## the fleet sorted by the short number, a new list every time it changes
+        sortedList = self.sortedList
+        if sortedList is None:
+            sortedList = sorted(self.locosByFullNumber.values(), key=lambda x: x.number)
+            self.sortedList = sortedList
+        return sortedList
+
+    def register(self, loco : Loco):
+        previous = self.locosByFullNumber.get(loco.fullNumber)
+        if previous is not None:
+            self.unregister(previous)
+
+        self.locosByFullNumber[loco.fullNumber] = loco
+        self.locosByNumber.setdefault(loco.number, []).append(loco)
+        self.sortedList = None
+        self.version += 1
+
+    def unregister(self, loco : Loco):
+        registered = self.locosByFullNumber.pop(loco.fullNumber, None)
+        if registered is None:
+            return
+
+        sameNumber = [loco for loco in self.locosByNumber.get(registered.number, []) if loco is not registered]
+        if len(sameNumber) == 0:
+            self.locosByNumber.pop(registered.number, None)
+        else:
+            self.locosByNumber[registered.number] = sameNumber
+        self.sortedList = None
+        self.version += 1
+
     def serialize(self):
         self._logger.info("Sorting and serializing the loco list...")
 
-        self.locoList.sort(key=lambda x: x.number)
-
         with open(self.dataConfigPath, "w", encoding='utf-8') as file:
             for loco in self.locoList:
                 file.write(f"{loco.number};{loco.fullNumber};{loco.note};{loco.editor};{loco.color}\n")
@@ -49,7 +106,18 @@ class LocoListHandler:
                 line = line.split(";")
                 if len(line) == 5:
                     locoList.append(Loco(line[0], line[1], line[2], line[3], line[4].strip()))
-            return locoList
+
+        ## the file is the whole fleet, the indexes start over
+        self.locosByFullNumber = {}
+        self.locosByNumber = {}
+        for loco in locoList:
+            self.register(loco)
+
+        ## an empty file is a change of the fleet as well
+        self.sortedList = None
+        self.version += 1
+
+        return locoList
         
     def deserializeColors(self, path : str):
         self._logger.info("Deserializing the colors...")
@@ -57,14 +125,19 @@ class LocoListHandler:
         data = json.load(file)
         file.close()
         return data
+
+    def invertColors(self, colorList : dict[str, list[str]]) -> dict[str, str]:
+        ## loco number to its colour, the first colour listing a loco wins as before
+        colorByNumber = {}
+        for color, numbers in colorList.items():
+            for number in numbers:
+                colorByNumber.setdefault(number, color)
+        return colorByNumber
     
     def getColor(self, loco : str):
         self._logger.info(f"Trying to find color for locomotive {loco}...")
         ## expecting that the loco is "749121" format
-        for color in self.colorList.keys():
-            if loco in self.colorList[color]:
-                return color
-        return None
+        return self.colorByNumber.get(loco)
 
     def addLoco(self, number : str, note : str, editor : str) -> Loco:
         self._logger.info(f"Trying to find .css color and adding locomotive {number}...")
@@ -73,25 +146,25 @@ class LocoListHandler:
         loco = None
         
         ## check for duplicates
-        for loco in self.locoList:
-            if loco.fullNumber == number:
-                self._logger.warning(f"Locomotive {number} already exists, updating...")
-                loco.note = note
-                loco.editor = editor
+        loco = self.locosByFullNumber.get(number)
+        if loco is not None:
+            self._logger.warning(f"Locomotive {number} already exists, updating...")
+            loco.note = note
+            loco.editor = editor
 
-                if (color is not None):
-                    loco.color = color
+            if (color is not None):
+                loco.color = color
 
-                self.serialize()
-                return loco
+            self.serialize()
+            return loco
 
         if (color is not None):
             self._logger.debug(f"Locomotive {number} has color: {color}...")
             loco = Loco(shortNum, number, note, editor, color)
-            self.locoList.append(loco)
+            self.register(loco)
         else:
             loco = Loco(shortNum, number, note, editor)
-            self.locoList.append(loco)
+            self.register(loco)
 
         self.serialize()
         return loco
@@ -105,16 +178,25 @@ class LocoListHandler:
     
     def removeLoco(self, loco : Loco):
         self._logger.info(f"Removing locomotive {loco.number}...")
-        self.locoList = [x for x in self.locoList if x.fullNumber != loco.fullNumber]
+        self.unregister(loco)
         self.serialize()
         return
     
     def getLoco(self, number : str):
-        for loco in self.locoList:
-            if loco.number == number:
-                return loco
+        ## a listed loco by its full or short number, otherwise a temporary one
+        loco = self.locosByFullNumber.get(number)
+        if loco is not None:
+            return loco
+
+        sameNumber = self.locosByNumber.get(number)
+        if sameNumber:
+            return sameNumber[0]
             
         return self.addLocoTemp(number)
+
+    def getLocoByFullNumber(self, fullNumber : str) -> Loco:
+        ## only listed locos, None otherwise
+        return self.locosByFullNumber.get(fullNumber)
     
     def parseFullLocoNumber(self, fullNumber : str):
         self._logger.info(f"Parsing full number {fullNumber}...")
@@ -0,0 +1,83 @@
+import os
+import gzip
+import time
+import hashlib
+import tempfile
+import threading
+
+## brotli is optional, without it only gzip variants are kept
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+class PageSnapshot:
+    ## One published version of a page, never changed after it is created. The compressed
+    ## variants are made once here, so serving the page never compresses anything.
+    def __init__(self, html : str, publishedAt : float):
+        self.html = html
+        self.body = html.encode("utf-8")
+        self.etag = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        self.publishedAt = publishedAt
+
+        self.variants : dict[str, bytes] = { 'gzip' : gzip.compress(self.body, compresslevel=6, mtime=0) }
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body, quality=9)
+
+    def negotiate(self, acceptEncodings) -> tuple[str, bytes]:
+        ## (content encoding, body) the client accepts best, None for the plain body
+        encoding = acceptEncodings.best_match([name for name in ('br', 'gzip') if name in self.variants] + ['identity'], default='identity')
+        if encoding in self.variants:
+            return encoding, self.variants[encoding]
+        return None, self.body
+
+class SnapshotPublisher:
+    ## Keeps the current snapshot of a page in memory and on disk. A new version is written
+    ## to a temporary file and renamed over the old one, then the in-memory reference is
+    ## swapped, so readers get either the whole old page or the whole new one and never wait.
+    def __init__(self, path : str):
+        self.path = path
+        self.lock = threading.RLock() ## orders the writers, readers do not take it
+        self.snapshot : PageSnapshot = self.load()
+
+    def load(self) -> PageSnapshot:
+        ## the page published by the previous run, if there is one
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "r", encoding="utf-8") as file:
+            return PageSnapshot(file.read(), os.path.getmtime(self.path))
+
+    def current(self) -> PageSnapshot:
+        return self.snapshot
+
+    def publish(self, html : str) -> PageSnapshot:
+        with self.lock:
+            snapshot = PageSnapshot(html, time.time())
+            self.write(snapshot)
+            self.snapshot = snapshot
+            return snapshot
+
+    def update(self, transform) -> PageSnapshot:
+        ## publishes transform(current html), no other writer can publish in between,
+        ## without a current page there is nothing to transform and None is returned
+        with self.lock:
+            current = self.snapshot
+            if current is None:
+                return None
+            return self.publish(transform(current.html))
+
+    def write(self, snapshot : PageSnapshot):
+        writeAtomically(self.path, snapshot.body)
+
+def writeAtomically(path : str, data : bytes):
+    ## written next to the target and renamed over it, so the file is never half written
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temporaryPath = tempfile.mkstemp(prefix=".snapshot-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        os.replace(temporaryPath, path)
+    except BaseException:
+        os.unlink(temporaryPath)
+        raise
@@ -0,0 +1,95 @@
+import time
+import threading
+
+## Never ask ISOR more often than this, whatever the configuration says
+POLITENESS_DELAY = 0.25
+
+class AdaptiveRateLimiter:
+    ## Token bucket whose refill rate follows AIMD: every healthy response adds a little
+    ## to the rate, a slow or failed one halves it. The rate stays between 1/maxDelay and
+    ## 1/minDelay, and minDelay is never below POLITENESS_DELAY.
+    ## The delay is measured from the end of the previous request to the start of the next
+    ## one, as the fixed requestDelay was, so a slow answer is never followed by a burst.
+    def __init__(self, startDelay : float = 0.5, minDelay : float = 0.35, maxDelay : float = 10, burst : float = 1,
+                 increase : float = 0.05, decrease : float = 0.5, latencyRiseFactor : float = 2, minSlowLatency : float = 1):
+        self.minDelay = max(minDelay, POLITENESS_DELAY) ## the configured ceiling of the rate
+        self.maxDelay = max(maxDelay, self.minDelay)
+        self.rate = 1 / min(max(startDelay, self.minDelay), self.maxDelay) ## requests per second
+        self.burst = burst
+
+        ## AIMD
+        self.increase = increase ## requests per second added after a healthy response
+        self.decrease = decrease ## rate multiplier after a bad one
+
+        ## a response is slow when it takes latencyRiseFactor times the usual time
+        self.latencyRiseFactor = latencyRiseFactor
+        self.minSlowLatency = minSlowLatency
+        self.latencyAverage = None
+
+        ## bucket
+        self.tokens = 1.0
+        self.lastRefill = time.time()
+        self.lock = threading.Lock()
+
+        ## counters
+        self.backoffs = 0
+        self.increases = 0
+
+    @property
+    def currentDelay(self) -> float:
+        return 1 / self.rate
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.lastRefill) * self.rate)
+        self.lastRefill = now
+
+    def restart(self):
+        ## a request just ended, the next one waits the whole delay from now
+        self.refill()
+        self.tokens = min(self.tokens, self.burst - 1)
+
+    def acquire(self, stopEvent : threading.Event = None) -> bool:
+        ## blocks until a request may be sent, False when stopped meanwhile
+        while stopEvent is None or not stopEvent.is_set():
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if stopEvent is not None:
+                stopEvent.wait(wait)
+            else:
+                time.sleep(wait)
+        return False
+
+    def record(self, latency : float, status : int, sessionExpired : bool = False):
+        with self.lock:
+            slow = self.latencyAverage is not None and latency > max(self.minSlowLatency, self.latencyRiseFactor * self.latencyAverage)
+
+            if status != 200 or sessionExpired or slow:
+                self.backoff()
+            else:
+                self.rate = min(1 / self.minDelay, self.rate + self.increase)
+                self.increases += 1
+
+            ## slow answers move the baseline only a little, so a slow period keeps us backing off for a while
+            weight = 0.05 if slow else 0.2
+            self.latencyAverage = latency if self.latencyAverage is None else (1 - weight) * self.latencyAverage + weight * latency
+
+            self.restart()
+
+    def recordFailure(self):
+        with self.lock:
+            self.backoff()
+            self.restart()
+
+    def backoff(self):
+        self.rate = max(1 / self.maxDelay, self.rate * self.decrease)
+        self.backoffs += 1
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return { 'currentDelay' : round(self.currentDelay, 3), 'latencyAverage' : self.latencyAverage, 'backoffs' : self.backoffs, 'increases' : self.increases }
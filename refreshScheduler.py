@@ -0,0 +1,130 @@
+import time
+import threading
+from zoneinfo import ZoneInfo
+from datetime import datetime
+from flask import Flask
+from locoHandler import Loco, LocoListHandler, LocoExportModel
+from dumper import IsorDumper
+from tableGenerator import TableGenerator
+
+class RefreshScheduler:
+    ## Spends a requests-per-hour budget on the locos whose data is the most overdue.
+    ## Every loco has a target age by its tier: moving ones are refreshed often, hot ones
+    ## (reservation or a move in the last 24h) less often and cold parked ones rarely.
+    ## A loco somebody looked at counts as moving for a while.
+    def __init__(self, logger : Flask.logger, locoHandler : LocoListHandler, dumper : IsorDumper, tableGenerator : TableGenerator, requestsPerHour : float = 240):
+        self._logger = logger
+        self.locoHandler = locoHandler
+        self.dumper = dumper
+        self.tableGenerator = tableGenerator
+
+        ## budget
+        self.requestsPerHour = requestsPerHour
+        self.tokens = 0.0
+        self.maxTokens = 20 ## the most requests spent in one tick
+        self.tickSeconds = 10
+
+        ## target data age per tier in seconds
+        self.tierIntervals = { 'moving' : 5 * 60, 'hot' : 20 * 60, 'cold' : 3 * 60 * 60 }
+        self.movingWithin = 2 * 60 * 60 ## a move this recent makes the loco moving
+        self.bumpDuration = 60 * 60 ## how long a viewed loco stays moving
+
+        self.bumpedAt : dict[str, float] = {}
+        self.bumpLock = threading.Lock()
+        self.stopEvent = threading.Event()
+
+        ## counters
+        self.requestsSpent = 0
+        self.ticks = 0
+
+    def Run(self):
+        self._logger.info(f"Starting the refresh scheduler with {self.requestsPerHour} requests per hour...")
+
+        lastTick = time.time()
+        while not self.stopEvent.wait(self.tickSeconds):
+            now = time.time()
+            self.tokens = min(self.maxTokens, self.tokens + (now - lastTick) * self.requestsPerHour / 3600)
+            lastTick = now
+
+            try:
+                self.tick()
+            except Exception as e:
+                self._logger.warning(f"Refresh scheduler tick failed: {e}")
+
+    def Stop(self):
+        self.stopEvent.set()
+
+    def bump(self, fullNumber : str):
+        ## somebody is interested in this loco
+        with self.bumpLock:
+            self.bumpedAt[fullNumber] = time.time()
+
+    def tick(self):
+        self.ticks += 1
+
+        batch = self.pickDue(int(self.tokens))
+        if len(batch) == 0:
+            return
+
+        self._logger.debug(f"Refresh scheduler refreshing {len(batch)} locomotives...")
+
+        self.tokens -= len(batch)
+        self.requestsSpent += len(batch)
+
+        for _, exportModel in self.dumper.dumpLocomotivesStream(batch):
+            self.tableGenerator.storeResult(exportModel)
+
+        ## republish only when no full refresh is writing the table meanwhile
+        self.tableGenerator.getIndexTableUnlessRefreshing(self.locoHandler.locoList, self.dumper.wholeTableRequestDelay)
+
+    def pickDue(self, count : int) -> list[Loco]:
+        ## the locos with the highest age / target age, only those already overdue
+        if count <= 0:
+            return []
+
+        now = time.time()
+        currentTime = datetime.now(ZoneInfo('Europe/Berlin'))
+
+        scored = []
+        for loco in list(self.locoHandler.locoList):
+            overdue = self.overdueRatio(loco, self.tableGenerator.lastResults.get(loco.fullNumber), now, currentTime)
+            if overdue >= 1:
+                scored.append((overdue, loco))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [loco for _, loco in scored[:count]]
+
+    def overdueRatio(self, loco : Loco, lastResult : LocoExportModel, now : float, currentTime : datetime) -> float:
+        if lastResult is None or lastResult.fetchedAt is None:
+            return float("inf")
+
+        return (now - lastResult.fetchedAt) / self.tierIntervals[self.getTier(loco, lastResult, now, currentTime)]
+
+    def getTier(self, loco : Loco, lastResult : LocoExportModel, now : float, currentTime : datetime) -> str:
+        with self.bumpLock:
+            bumpedAt = self.bumpedAt.get(loco.fullNumber)
+
+        if bumpedAt is not None and now - bumpedAt < self.bumpDuration:
+            return 'moving'
+        if TableGenerator.ContentModel.movedWithin(lastResult, currentTime, self.movingWithin):
+            return 'moving'
+        if TableGenerator.ContentModel.isHot(lastResult, currentTime):
+            return 'hot'
+        return 'cold'
+
+    def getStats(self) -> dict:
+        ## average data age per tier, in seconds
+        now = time.time()
+        currentTime = datetime.now(ZoneInfo('Europe/Berlin'))
+        ages = { tier : [] for tier in self.tierIntervals }
+
+        for loco in list(self.locoHandler.locoList):
+            lastResult = self.tableGenerator.lastResults.get(loco.fullNumber)
+            if lastResult is not None and lastResult.fetchedAt is not None:
+                ages[self.getTier(loco, lastResult, now, currentTime)].append(now - lastResult.fetchedAt)
+
+        return {
+            'requestsSpent' : self.requestsSpent,
+            'ticks' : self.ticks,
+            'averageAge' : { tier : (sum(values) / len(values) if values else None) for tier, values in ages.items() },
+        }
@@ -0,0 +1,69 @@
+import time
+import threading
+from collections import OrderedDict
+
+class CacheEntry:
+    def __init__(self, value, storedAt : float):
+        self.value = value
+        self.storedAt = storedAt
+
+    def age(self) -> float:
+        return time.time() - self.storedAt
+
+class ResponseCache:
+    ## Bounded LRU cache of parsed ISOR answers, every kind ("loco", "train") has its own TTL
+    def __init__(self, ttls : dict[str, float], maxEntries : int = 1000):
+        self.ttls = ttls
+        self.maxEntries = maxEntries
+        self.entries : OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+
+        ## counters
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind : str, key : str) -> CacheEntry:
+        with self.lock:
+            entry = self.entries.get((kind, key))
+
+            if entry is None or entry.age() > self.ttls.get(kind, 0):
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end((kind, key))
+            self.hits += 1
+            return entry
+
+    def put(self, kind : str, key : str, value, storedAt : float = None):
+        with self.lock:
+            self.entries[(kind, key)] = CacheEntry(value, storedAt if storedAt is not None else time.time())
+            self.entries.move_to_end((kind, key))
+
+            ## evict the least recently used ones
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+
+    def getStoredAt(self, kind : str, key : str) -> float:
+        ## like get, but neither counts nor refreshes the LRU order
+        with self.lock:
+            entry = self.entries.get((kind, key))
+            if entry is None or entry.age() > self.ttls.get(kind, 0):
+                return None
+            return entry.storedAt
+
+    def invalidate(self, kind : str, key : str = None):
+        ## without a key the whole kind is dropped
+        with self.lock:
+            if key is not None:
+                self.entries.pop((kind, key), None)
+            else:
+                for cacheKey in [cacheKey for cacheKey in self.entries if cacheKey[0] == kind]:
+                    del self.entries[cacheKey]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return { 'entries' : len(self.entries), 'hits' : self.hits, 'misses' : self.misses }
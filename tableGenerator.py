@@ -1,19 +1,72 @@
+import os
+import json
+import time
+import html
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
 from zoneinfo import ZoneInfo
 from datetime import datetime, timedelta
 from locoHandler import Loco, LocoListHandler, LocoExportModel
 from dumper import IsorDumper
+from isorParser import RouteResult, RouteStop
+from historyStore import HistoryEntry
+from templateRenderer import TemplateStore
+from pageSnapshot import SnapshotPublisher, PageSnapshot, writeAtomically
+from fleetIndex import FleetIndex, FleetQuery, parseLocoTime
 
 class TableGenerator:
     def __init__(self, path : str):
-        ## output.html LOCK
+        ## output.html, published as a whole and served from memory
         self.outputDataPath = path
-        self.outputLock = False
+        self.outputSnapshot = SnapshotPublisher(path)
         self.templateTablePath = "templates/table.html"
         self.templateTableRowPath = "templates/tableRow.html"
         self.templateTableEmptyRowPath = "templates/emptyRow.html"
         self.templateAdditionTablePath = "templates/add.html"
         self.templateAdditionTableRowPath = "templates/addRow.html"
         self.templateRouteTable = "templates/route.html"
+        self.templateRouteStopsTable = "templates/routeTable.html"
+        self.templateRouteStopPath = "templates/routeStop.html"
+        self.templateRouteLocosPath = "templates/routeLocos.html"
+        self.templateRouteLocoPath = "templates/routeLoco.html"
+        self.templateDataAgePath = "templates/dataAge.html"
+        self.templateHistoryPath = "templates/history.html"
+        self.templateHistoryRowPath = "templates/historyRow.html"
+        self.templateProgressRowPath = "templates/progressRow.html"
+        self.templateProgressHeadPath = "templates/progressHead.html"
+        self.templateFilterFormPath = "templates/filterForm.html"
+        self.templateFilterOptionPath = "templates/filterOption.html"
+        self.templatePagerRowPath = "templates/pagerRow.html"
+        self.templatePagerLinkPath = "templates/pagerLink.html"
+
+        ## templates are read and compiled once, then again only when they change on disk
+        self.templates = TemplateStore()
+
+        ## progressive refresh
+        self.lastResults : dict[str, LocoExportModel] = {} ## latest known row of every loco
+        self.refreshProgress = None
+        self.refreshLock = threading.Lock() ## held by a running full refresh
+        self.progressWriteInterval = 2 ## seconds between two snapshots while refreshing
+        self.progressPageReload = 5 ## seconds, browsers reload the page while refreshing
+
+        ## rendered rows keyed by loco full id, reused while the shown values stay the same
+        self.rowCache : dict[str, tuple[tuple, str]] = {}
+        self.rowsRendered = 0
+        self.rowsReused = 0
+
+        ## rows of the published index page keyed by loco full id, in the order of the page
+        self.indexRows : dict[str, LocoExportModel] = {}
+        self.indexTimes : tuple[str, str] = None ## (last update, next update) shown on the page
+        self.fleetIndex = FleetIndex() ## filters and sort orders over indexRows
+        self.indexRowsPath = os.path.splitext(path)[0] + ".json" ## the row model of the published page, kept for the next run
+
+        ## rendered and compressed route pages by train, made again only when the page would change
+        self.routeSnapshots : OrderedDict[str, tuple[tuple, object, PageSnapshot]] = OrderedDict()
+        self.routeSnapshotsMax = 200
+        self.routeSnapshotsLock = threading.Lock()
+
+        self.loadIndexRows()
 
     class ContentModel:
         def __init__(self, locomotives : list[LocoExportModel]):
@@ -34,134 +87,417 @@ class TableGenerator:
             currentTime = datetime.now(ZoneInfo('Europe/Berlin'))
             for loco in locomotives:
 
-                if loco.time is None or loco.time == "":
+                if TableGenerator.ContentModel.isHot(loco, currentTime):
+                    self.hotLocomotives.append(loco)
+                else:
                     self.coldLocomotives.append(loco)
 
-                else:
-                    timeDiff = currentTime.replace(tzinfo=None) - datetime.strptime(loco.time, "%d.%m.%Y %H:%M")
-                    timeDiffSeconds = timeDiff.total_seconds()
+        @staticmethod
+        def isHot(loco : LocoExportModel, currentTime : datetime) -> bool:
+            if loco.time is None or loco.time == "":
+                return False
+            return (loco.trainNumReservation != "---") or TableGenerator.ContentModel.movedWithin(loco, currentTime, 24 * 3600) ## when having a reservation or a move in the last 24h
+
+        @staticmethod
+        def movedWithin(loco : LocoExportModel, currentTime : datetime, seconds : float) -> bool:
+            if loco.time is None or loco.time == "":
+                return False
 
-                    if (loco.trainNumReservation != "---") or ( (timeDiffSeconds / 3600 ) <= 24 ): ## when having a reservation or a move in the last 24h
-                        self.hotLocomotives.append(loco)
-                    else:
-                        self.coldLocomotives.append(loco)
+            timeDiff = currentTime.replace(tzinfo=None) - parseLocoTime(loco.time)
+            return timeDiff.total_seconds() <= seconds
+
+    class RefreshProgress:
+        def __init__(self, total : int):
+            self.total = total
+            self.done = 0
+            self.startedAt = time.time()
+
+        def remainingSeconds(self) -> float:
+            if self.done == 0:
+                return None
+            return (time.time() - self.startedAt) / self.done * (self.total - self.done)
 
     def getIndexTableAsync(self, locomotives : list[Loco], dumper : IsorDumper):
-        self.getIndexTable(dumper.dumpLocomotivesPOST(locomotives), dumper.wholeTableRequestDelay)
+        ## rows are published as they arrive, the locos not refreshed yet keep their previous row
+        with self.refreshLock:
+            self.refreshProgress = TableGenerator.RefreshProgress(len(locomotives))
+            lastWrite = time.time()
+
+            try:
+                for _, exportModel in dumper.dumpLocomotivesStream(locomotives):
+                    self.storeResult(exportModel)
+                    self.refreshProgress.done += 1
+
+                    if time.time() - lastWrite >= self.progressWriteInterval:
+                        self.getIndexTable(self.collectResults(locomotives), dumper.wholeTableRequestDelay, self.refreshProgress)
+                        lastWrite = time.time()
+            finally:
+                self.refreshProgress = None
+
+                ## the next manual refresh is counted from the end of this one
+                dumper.lastRequest_wholeTable = time.time()
+
+            self.getIndexTable(self.collectResults(locomotives), dumper.wholeTableRequestDelay)
+
+    ## Republishes the index page from the latest results, unless a full refresh is running, which publishes them itself
+    def getIndexTableUnlessRefreshing(self, locomotives : list[Loco], delay : int) -> bool:
+        if not self.refreshLock.acquire(blocking=False):
+            return False
+
+        try:
+            self.getIndexTable(self.collectResults(locomotives), delay)
+        finally:
+            self.refreshLock.release()
+        return True
 
-    def getIndexTable(self, response : list[LocoExportModel], delay : int):
+    ## A failed request (no answer, an error or an unreadable page) keeps the previous row of the loco
+    def storeResult(self, exportModel : LocoExportModel) -> bool:
+        if exportModel.fetchedAt is None and exportModel.fullId in self.lastResults:
+            return False
+
+        self.lastResults[exportModel.fullId] = exportModel
+        return True
+
+    def collectResults(self, locomotives : list[Loco]) -> list[LocoExportModel]:
+        return [self.lastResults[loco.fullNumber] for loco in locomotives if loco.fullNumber in self.lastResults]
+
+    def getIndexTable(self, response : list[LocoExportModel], delay : int, progress : RefreshProgress = None):
         currentTime = datetime.now(ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
         nextUpdateTime = (datetime.now(ZoneInfo('Europe/Berlin')) + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
 
-        table = self.createTable(response, currentTime, nextUpdateTime)
-        ## save the table to a file
+        with self.outputSnapshot.lock:
+            self.indexRows = { data.fullId : data for data in response }
+            self.indexTimes = (currentTime, nextUpdateTime)
+            self.fleetIndex.replaceAll(response)
+            self.publishIndexTable(progress)
+
+    ## Renders the row model, unchanged rows come from the row cache
+    def publishIndexTable(self, progress : RefreshProgress = None):
+        with self.outputSnapshot.lock:
+            self.outputSnapshot.publish(self.createTable(list(self.indexRows.values()), self.indexTimes[0], self.indexTimes[1], progress))
+            self.saveIndexRows()
+
+    def saveIndexRows(self):
+        data = { 'updateTime' : self.indexTimes[0], 'nextUpdateTime' : self.indexTimes[1], 'rows' : [row.toDict() for row in self.indexRows.values()] }
+        writeAtomically(self.indexRowsPath, json.dumps(data, ensure_ascii=False).encode("utf-8"))
 
-        self.outputLock = True
+    ## The row model of the page published by the previous run, so filters and updates work right after a restart
+    def loadIndexRows(self):
+        if not os.path.exists(self.indexRowsPath):
+            return
 
-        with open(self.outputDataPath, "w", encoding="utf-8") as file:
-            file.write(table)
+        try:
+            with open(self.indexRowsPath, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            rows = [LocoExportModel.fromDict(row) for row in data['rows']]
+        except (OSError, ValueError, KeyError):
+            return ## the page is then patched as before, until the next full refresh
 
-        self.outputLock = False
+        with self.outputSnapshot.lock:
+            self.indexRows = { row.fullId : row for row in rows }
+            self.indexTimes = (data['updateTime'], data['nextUpdateTime'])
+            self.fleetIndex.replaceAll(rows)
+            for row in rows:
+                self.lastResults.setdefault(row.fullId, row)
 
+    ## Adds or refreshes one loco on the index page
     def updateIndexTable(self, response):
-        newRow = self.fillTableRow(response)
-        data = ""
-        with open(self.outputDataPath, "r", encoding="utf-8") as file:
-            data = file.read()
+        if not self.storeResult(response):
+            return ## the row already shown stays
+
+        with self.outputSnapshot.lock:
+            if self.indexTimes is None and self.outputSnapshot.current() is None:
+                ## no page to patch, the whole page is rendered from the known rows
+                currentTime = self.formatTime(time.time())
+                self.indexRows = dict(self.lastResults)
+                self.indexTimes = (currentTime, currentTime)
+                self.fleetIndex.replaceAll(list(self.indexRows.values()))
+                self.publishIndexTable(self.refreshProgress)
+                return
+
+            if self.indexTimes is None:
+                ## nothing rendered by this run yet, patch the page left by the previous one
+                newRow = self.fillTableRow(response)
+                self.outputSnapshot.update(lambda data: data.replace('<!-- [EMPTY-ROW] -->', f"{newRow}\n<!-- [EMPTY-ROW] -->\n"))
+                self.fleetIndex.update(response)
+                return
 
-        data = data.replace('<!-- [EMPTY-ROW] -->', f"{newRow}\n<!-- [EMPTY-ROW] -->\n")
+            self.indexRows[response.fullId] = response
+            self.fleetIndex.update(response)
+            self.publishIndexTable(self.refreshProgress)
 
-        self.outputLock = True
+    ## Removes one loco from the index page
+    def removeIndexRow(self, fullId : str):
+        self.lastResults.pop(fullId, None)
+        self.rowCache.pop(fullId, None)
 
-        with open(self.outputDataPath, "w", encoding="utf-8") as file:
-            file.writelines(data)
+        with self.outputSnapshot.lock:
+            if self.indexRows.pop(fullId, None) is not None:
+                self.fleetIndex.remove(fullId)
+                self.publishIndexTable(self.refreshProgress)
 
-        self.outputLock = False
+    ## One page of the filtered and sorted fleet, rendered from the indexes
+    def getFilteredIndexTable(self, query : FleetQuery):
+        total, rows = self.fleetIndex.query(query, datetime.now(ZoneInfo('Europe/Berlin')))
+        updateTime, nextUpdateTime = self.indexTimes if self.indexTimes is not None else ("", "")
+
+        return self.fillTableTemplate("".join(self.fillTableRow(data) for data in rows), updateTime, nextUpdateTime, None, query, total)
     
     def getSingleLocoIndexTable(self, response, delay):
-        currentTime = datetime.now(ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
+        currentTime = self.formatDataTime(response.fetchedAt)
         nextUpdateTime = (datetime.now(ZoneInfo('Europe/Berlin')) + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
         table = self.createTable([response], currentTime, nextUpdateTime) ## making a list with one element to use the same function
         return table
     
-    def getRouteTable(self, response, delay):
-        currentTime = datetime.now(ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
-        nextUpdateTime = (datetime.now(ZoneInfo('Europe/Berlin')) + timedelta(seconds=delay)).strftime("%Y-%m-%d %H:%M:%S")
-        table = self.fillRouteTemplate(response, currentTime, nextUpdateTime)
-        return table
+    ## The route page as a snapshot, one per version of the route, its times and the locos on the train
+    def getRouteSnapshot(self, train : str, response, nextRequestAt : float, fetchedAt : float = None, locos : tuple[list[LocoExportModel], list[LocoExportModel]] = ([], [])) -> PageSnapshot:
+        currentTime = self.formatTime(fetchedAt if fetchedAt is not None else time.time())
+        nextUpdateTime = self.formatTime(nextRequestAt) if nextRequestAt > time.time() else "nyní" ## a fixed text, so the page stays the same
+        key = (currentTime, nextUpdateTime, tuple(loco.fullId for loco in locos[0]), tuple(loco.fullId for loco in locos[1]))
+
+        with self.routeSnapshotsLock:
+            cached = self.routeSnapshots.get(train)
+            if cached is not None and cached[0] == key and cached[1] is response:
+                self.routeSnapshots.move_to_end(train)
+                return cached[2]
+
+        snapshot = PageSnapshot(self.fillRouteTemplate(response, currentTime + self.fillDataAge(fetchedAt), nextUpdateTime, locos), fetchedAt if fetchedAt is not None else time.time())
+
+        with self.routeSnapshotsLock:
+            self.routeSnapshots[train] = (key, response, snapshot)
+            self.routeSnapshots.move_to_end(train)
+            while len(self.routeSnapshots) > self.routeSnapshotsMax:
+                self.routeSnapshots.popitem(last=False)
+
+        return snapshot
+
+    def formatTime(self, timestamp : float):
+        return datetime.fromtimestamp(timestamp, ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
+
+    ## Time of the shown data, with its age when it is served from the cache
+    def formatDataTime(self, fetchedAt : float = None):
+        if fetchedAt is None:
+            return datetime.now(ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
+
+        fetchedTime = datetime.fromtimestamp(fetchedAt, ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S")
+        age = int(datetime.now().timestamp() - fetchedAt)
+
+        if age < 1:
+            return fetchedTime
+        return f"{fetchedTime} (před {age} s)"
+
+    ## Age of the shown data in a cached page, counted by the browser as the page stays the same
+    def fillDataAge(self, fetchedAt : float = None):
+        if fetchedAt is None:
+            return ""
+
+        return self.templates.render(self.templateDataAgePath, { "[DATA-FETCHED-AT]" : f"{fetchedAt:.3f}" })
 
     ## Creates a new table with pictures and buttons
-    def createTable(self, response : list[LocoExportModel], updateTime : str, nextUpdateTime : str):
-        return self.fillTable(TableGenerator.ContentModel(response), updateTime, nextUpdateTime)
+    def createTable(self, response : list[LocoExportModel], updateTime : str, nextUpdateTime : str, progress : RefreshProgress = None):
+        return self.fillTable(TableGenerator.ContentModel(response), updateTime, nextUpdateTime, progress)
 
     ## Fills the table with all pictures in the picture directory
-    def fillTable(self, response : ContentModel, updateTime : str, nextUpdateTime : str):
-        rows = ""
+    def fillTable(self, response : ContentModel, updateTime : str, nextUpdateTime : str, progress : RefreshProgress = None):
+        rows = []
 
         ## when only single loco, create just one entry
         if (response.singleLoco is not None):
-            rows += self.fillTableRow(response.singleLoco)
+            rows.append(self.fillTableRow(response.singleLoco))
 
         ## else fill the whole table and separate hot/cold locos
         else:
             ## fill fresh locos
             for data in response.hotLocomotives:
-                rows += self.fillTableRow(data)
+                rows.append(self.fillTableRow(data))
             
             ## make spacing
-            rows += self.fillEmptyTableRow()
+            rows.append(self.fillEmptyTableRow())
 
             ## fill cold locos
             for data in response.coldLocomotives:
-                rows += self.fillTableRow(data)
+                rows.append(self.fillTableRow(data))
+
+        return self.fillTableTemplate("".join(rows), updateTime, nextUpdateTime, progress)
+
+    def fillTableTemplate(self, rows : str, updateTime : str, nextUpdateTime : str, progress : RefreshProgress = None, query : FleetQuery = None, total : int = None):
+        return self.templates.render(self.templateTablePath, {
+            "[TABLE-ROWS]" : rows,
+            "[TABLE-LAST-UPDATE]" : updateTime,
+            "[TABLE-NEXT-UPDATE]" : nextUpdateTime,
+            "[TABLE-PROGRESS]" : self.fillProgressRow(progress),
+            "[TABLE-HEAD]" : self.fillProgressHead(progress),
+            "[TABLE-FILTER]" : self.fillFilterForm(query if query is not None else FleetQuery()),
+            "[TABLE-PAGER]" : self.fillPagerRow(query, total),
+        })
+
+    ## The filter of the fleet table, the options are the values shown on the index page
+    def fillFilterForm(self, query : FleetQuery):
+        functions, colors = self.fleetIndex.getChoices()
+
+        return self.templates.render(self.templateFilterFormPath, {
+            "[FILTER-STATION]" : html.escape(query.station),
+            "[FILTER-FUNCTIONS]" : self.fillFilterOptions([""] + functions, query.function, { "" : "Funkce" }),
+            "[FILTER-TRAIN]" : html.escape(query.train),
+            "[FILTER-COLORS]" : self.fillFilterOptions([""] + colors, query.color, { "" : "Lak" }),
+            "[FILTER-STATES]" : self.fillFilterOptions(FleetQuery.states, query.state, { "" : "Vše", "hot" : "Aktivní", "cold" : "Odstavené" }),
+            "[FILTER-SORTS]" : self.fillFilterOptions(FleetQuery.sorts, query.sort, { "" : "Řazení", "time" : "Podle času", "position" : "Podle pozice" }),
+        })
+
+    def fillFilterOptions(self, values : list[str], selected : str, labels : dict[str, str]):
+        return "".join(self.templates.render(self.templateFilterOptionPath, {
+            "[OPTION-VALUE]" : html.escape(value),
+            "[OPTION-SELECTED]" : " selected" if value == selected else "",
+            "[OPTION-LABEL]" : html.escape(labels.get(value, value)),
+        }) for value in values)
+
+    ## Page links of a filtered view, empty on the full index page
+    def fillPagerRow(self, query : FleetQuery, total : int):
+        if query is None:
+            return ""
+
+        pages = max(1, (total + query.pageSize - 1) // query.pageSize)
+
+        return self.templates.render(self.templatePagerRowPath, {
+            "[PAGER-PREVIOUS]" : self.fillPagerLink(query, query.page - 1, "&lt; Předchozí") + " | " if query.page > 1 else "",
+            "[PAGER-PAGE]" : str(query.page),
+            "[PAGER-PAGES]" : str(pages),
+            "[PAGER-TOTAL]" : str(total),
+            "[PAGER-NEXT]" : " | " + self.fillPagerLink(query, query.page + 1, "Další &gt;") if query.page < pages else "",
+        })
+
+    def fillPagerLink(self, query : FleetQuery, page : int, label : str):
+        return self.templates.render(self.templatePagerLinkPath, {
+            "[PAGER-QUERY]" : html.escape(urlencode(query.toArgs(page))),
+            "[PAGER-LABEL]" : label,
+        })
+
+    ## Progress of a running refresh, empty when there is none
+    def fillProgressRow(self, progress : RefreshProgress = None):
+        if progress is None:
+            return ""
 
-        template = open(self.templateTablePath, "r", encoding="utf-8").read()
-        template = template.replace("[TABLE-ROWS]", rows)
-        template = template.replace("[TABLE-LAST-UPDATE]", updateTime)
-        template = template.replace("[TABLE-NEXT-UPDATE]", nextUpdateTime)
-        return template
+        remaining = progress.remainingSeconds()
 
-    ## Fills a table row with the picture and buttons
+        return self.templates.render(self.templateProgressRowPath, {
+            "[PROGRESS-DONE]" : str(progress.done),
+            "[PROGRESS-TOTAL]" : str(progress.total),
+            "[PROGRESS-REMAINING]" : f", zbývá cca {int(remaining // 60)} min {int(remaining % 60)} s" if remaining is not None else "",
+        })
+
+    ## Browsers reload the page while a refresh is running
+    def fillProgressHead(self, progress : RefreshProgress = None):
+        if progress is None:
+            return ""
+
+        return self.templates.render(self.templateProgressHeadPath, { "[PROGRESS-RELOAD]" : str(self.progressPageReload) })
+
+    ## Fills a table row with the picture and buttons, unchanged rows come from the row cache
     def fillTableRow(self, data : LocoExportModel):
-        template = open(self.templateTableRowPath, "r", encoding="utf-8").read()
-        template = template.replace("[LOCO_ID]", data.id)
-        template = template.replace("[LOCO_FULL_ID]", data.fullId)
-
-        if (data.color is not None): ## color can be None when the loco is not in the list
-            template = template.replace("[LOCO_COLOR]", data.color)
-
-        template = template.replace("[LOCO_FUNCTION]", data.function)
-        template = template.replace("[LOCO_TRAIN_NUM]", data.trainNum)
-        template = template.replace("[LOCO_TRAIN_NUM_RESERVATION]", data.trainNumReservation)
-        template = template.replace("[LOCO_POSITION]", data.place)
-        template = template.replace("[LOCO_TIME]", data.time)
-        return template
+        rowKey = (data.id, data.color, data.function, data.trainNum, data.trainNumReservation, data.place, data.time)
+
+        cached = self.rowCache.get(data.fullId)
+        if cached is not None and cached[0] == rowKey:
+            self.rowsReused += 1
+            return cached[1]
+
+        row = self.renderTableRow(data)
+        self.rowCache[data.fullId] = (rowKey, row)
+        self.rowsRendered += 1
+
+        return row
+
+    def renderTableRow(self, data : LocoExportModel):
+        return self.templates.render(self.templateTableRowPath, {
+            "[LOCO_ID]" : data.id,
+            "[LOCO_FULL_ID]" : data.fullId,
+            "[LOCO_COLOR]" : data.color, ## color can be None when the loco is not in the list
+            "[LOCO_FUNCTION]" : data.function,
+            "[LOCO_TRAIN_NUM]" : data.trainNum,
+            "[LOCO_TRAIN_NUM_RESERVATION]" : data.trainNumReservation,
+            "[LOCO_POSITION]" : data.place,
+            "[LOCO_TIME]" : data.time,
+        })
     
     def fillEmptyTableRow(self):
-        template = open(self.templateTableEmptyRowPath, "r", encoding="utf-8").read()
-        return template
+        return self.templates.render(self.templateTableEmptyRowPath, {})
 
     def createAdditionTable(self, data : LocoListHandler):
         return self.fillAdditionTable(data)
     
     def fillAdditionTable(self, data : LocoListHandler):
-        rows = ""
-        for loco in data.locoList:
-            rows += self.fillAdditionTableRow(loco)
-        template = open(self.templateAdditionTablePath, "r", encoding="utf-8").read()
-        template = template.replace("[TABLE-ROWS]", rows)
-        return template
+        rows = "".join(self.fillAdditionTableRow(loco) for loco in data.locoList)
+        return self.templates.render(self.templateAdditionTablePath, { "[TABLE-ROWS]" : rows })
     
     def fillAdditionTableRow(self, data : Loco):
-        template = open(self.templateAdditionTableRowPath, "r", encoding="utf-8").read()
-        template = template.replace("[LOCO-ID]", data.fullNumber)
-        template = template.replace("[LOCO-NOTE]", data.note)
-        template = template.replace("[LOCO-EDITOR-NAME]", data.editor)
-        return template
+        return self.templates.render(self.templateAdditionTableRowPath, {
+            "[LOCO-ID]" : data.fullNumber,
+            "[LOCO-NOTE]" : data.note,
+            "[LOCO-EDITOR-NAME]" : data.editor,
+        })
     
-    def fillRouteTemplate(self, data, updateTime, nextRequestTime):
-        template = open(self.templateRouteTable, "r", encoding="utf-8").read()
-        template = template.replace("[ROUTE-LAST-UPDATE]", updateTime)
-        template = template.replace("[ROUTE-NEXT-UPDATE]", nextRequestTime)
-        template = template.replace("[ROUTE-CONTENT]", data)
-        return template
\ No newline at end of file
+    def fillRouteTemplate(self, data, updateTime, nextRequestTime, locos : tuple[list[LocoExportModel], list[LocoExportModel]] = ([], [])):
+        return self.templates.render(self.templateRouteTable, {
+            "[ROUTE-LAST-UPDATE]" : updateTime,
+            "[ROUTE-NEXT-UPDATE]" : nextRequestTime,
+            "[ROUTE-LOCOS]" : self.fillRouteLocos(locos),
+            "[ROUTE-CONTENT]" : self.fillRouteContent(data),
+        })
+
+    ## Timeline of one loco from the local history, the newest first
+    def getHistoryTable(self, locoId : str, entries : list[HistoryEntry], days : float):
+        rows = "".join(self.fillHistoryRow(entry) for entry in entries)
+
+        return self.templates.render(self.templateHistoryPath, {
+            "[HISTORY-LOCO-ID]" : locoId,
+            "[HISTORY-DAYS]" : f"{days:g}",
+            "[HISTORY-ROWS]" : rows,
+        })
+
+    def fillHistoryRow(self, entry : HistoryEntry):
+        return self.templates.render(self.templateHistoryRowPath, {
+            "[HISTORY-FETCHED]" : datetime.fromtimestamp(entry.fetchedAt, ZoneInfo('Europe/Berlin')).strftime("%Y-%m-%d %H:%M:%S"),
+            "[HISTORY-FUNCTION]" : entry.function,
+            "[HISTORY-TRAIN-NUM]" : entry.trainNum,
+            "[HISTORY-TRAIN-NUM-RESERVATION]" : entry.trainNumReservation,
+            "[HISTORY-POSITION]" : entry.place,
+            "[HISTORY-TIME]" : entry.time,
+        })
+
+    ## Our locos on the train by the latest results, empty when there are none
+    def fillRouteLocos(self, locos : tuple[list[LocoExportModel], list[LocoExportModel]]):
+        hauling, reserved = locos
+        if len(hauling) == 0 and len(reserved) == 0:
+            return ""
+
+        links = [self.fillRouteLoco(loco, "") for loco in hauling] + [self.fillRouteLoco(loco, " (rezervace)") for loco in reserved]
+        return self.templates.render(self.templateRouteLocosPath, { "[ROUTE-LOCO-LINKS]" : ", ".join(links) })
+
+    def fillRouteLoco(self, loco : LocoExportModel, note : str):
+        return self.templates.render(self.templateRouteLocoPath, {
+            "[LOCO_ID]" : loco.id,
+            "[LOCO_FULL_ID]" : loco.fullId,
+            "[LOCO_COLOR]" : loco.color or "",
+            "[LOCO_NOTE]" : note,
+        })
+
+    ## The route table, or the text as is for messages and routes that could not be read
+    def fillRouteContent(self, data):
+        if not isinstance(data, RouteResult):
+            return data
+
+        if len(data.stops) == 0:
+            return data.raw
+
+        stops = "".join(self.fillRouteStop(stop) for stop in data.stops)
+        return self.templates.render(self.templateRouteStopsTable, { "[ROUTE-STOPS]" : stops })
+
+    def fillRouteStop(self, stop : RouteStop):
+        return self.templates.render(self.templateRouteStopPath, {
+            "[STOP-STATION]" : stop.station,
+            "[STOP-ARRIVAL-PLANNED]" : stop.arrivalPlanned,
+            "[STOP-ARRIVAL-ACTUAL]" : stop.arrivalActual,
+            "[STOP-DEPARTURE-PLANNED]" : stop.departurePlanned,
+            "[STOP-DEPARTURE-ACTUAL]" : stop.departureActual,
+            "[STOP-DELAY]" : f"{stop.delay:+d}" if stop.delay is not None else "",
+        })
\ No newline at end of file
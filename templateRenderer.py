@@ -0,0 +1,65 @@
+import os
+import re
+import time
+import threading
+
+## placeholders look like [TABLE-ROWS] or [LOCO_ID]
+placeholderPattern = re.compile(r"\[[A-Z][A-Z0-9_\-]*\]")
+
+class CompiledTemplate:
+    ## The template split once into its text and its placeholders, a render is one join.
+    ## Placeholders without a value stay in the output as they are.
+    def __init__(self, text : str):
+        self.parts : list[str] = []
+        self.slots : list[tuple[int, str]] = [] ## (index in parts, placeholder)
+
+        position = 0
+        for match in placeholderPattern.finditer(text):
+            self.parts.append(text[position:match.start()])
+            self.slots.append((len(self.parts), match.group(0)))
+            self.parts.append(match.group(0))
+            position = match.end()
+        self.parts.append(text[position:])
+
+    def render(self, values : dict[str, str]) -> str:
+        parts = self.parts.copy()
+        for index, placeholder in self.slots:
+            value = values.get(placeholder)
+            if value is not None:
+                parts[index] = value
+        return "".join(parts)
+
+class TemplateStore:
+    ## Compiled templates by path. A file is compiled again when it changes on disk,
+    ## checked at most once per checkInterval so rendering a row does not touch the disk.
+    def __init__(self, checkInterval : float = 2):
+        self.checkInterval = checkInterval
+        self.templates : dict[str, tuple[int, float, CompiledTemplate]] = {} ## path to (mtime, checkedAt, template)
+        self.lock = threading.Lock()
+
+        ## counters
+        self.compilations = 0
+
+    def get(self, path : str) -> CompiledTemplate:
+        now = time.monotonic()
+
+        entry = self.templates.get(path)
+        if entry is not None and now - entry[1] < self.checkInterval:
+            return entry[2]
+
+        with self.lock:
+            modifiedAt = os.stat(path).st_mtime_ns
+
+            entry = self.templates.get(path)
+            if entry is not None and entry[0] == modifiedAt:
+                template = entry[2]
+            else:
+                with open(path, "r", encoding="utf-8") as file:
+                    template = CompiledTemplate(file.read())
+                self.compilations += 1
+
+            self.templates[path] = (modifiedAt, now, template)
+            return template
+
+    def render(self, path : str, values : dict[str, str]) -> str:
+        return self.get(path).render(values)
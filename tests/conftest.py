@@ -0,0 +1,34 @@
+import os
+import sys
+import base64
+import pytest
+
+rootPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, rootPath)
+
+from fakeIsorServer import FakeIsorServer
+
+@pytest.fixture(scope="session")
+def fakeIsor():
+    with FakeIsorServer() as server:
+        yield server
+
+@pytest.fixture(scope="session")
+def isorApp(fakeIsor, tmp_path_factory):
+    ## the app against the fake server, without the background refresh and with its own history
+    os.chdir(rootPath)
+    os.environ['ISOR_BASE_URL'] = fakeIsor.baseUrl
+    os.environ['ISOR_REFRESH_BUDGET'] = "0"
+    os.environ['ISOR_DATA_HISTORY_PATH'] = str(tmp_path_factory.mktemp("history") / "history.sqlite")
+
+    import app
+    yield app
+
+    app.isorClient.Stop()
+
+@pytest.fixture
+def client(isorApp):
+    credentials = base64.b64encode(f"{isorApp.app.config['BASIC_AUTH_USERNAME']}:{isorApp.app.config['BASIC_AUTH_PASSWORD']}".encode("utf-8")).decode("ascii")
+    client = isorApp.app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f"Basic {credentials}"
+    return client
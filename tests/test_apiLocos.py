@@ -0,0 +1,18 @@
+def test_lookedUpLocoOutsideTheFleetIsNotListed(isorApp, client):
+    fleetLoco = isorApp.locoHandler.locoList[0]
+    otherId = "925427530010"
+    assert isorApp.locoHandler.getLocoByFullNumber(otherId) is None
+
+    assert client.get(f"/get/loco/{fleetLoco.fullNumber}").status_code == 200
+    isorApp.isorDumper.lastRequest_singleQuery = 0 ## the next lookup is not throttled
+    assert client.get(f"/get/loco/{otherId}").status_code == 200
+
+    ## both lookups are indexed, only the fleet loco is served by the API
+    _, results = isorApp.isorDumper.trainIndex.getResults()
+    assert {fleetLoco.fullNumber, otherId} <= { result.fullId for result in results }
+
+    response = client.get("/api/locos")
+    assert response.status_code == 200
+    fullIds = [loco['fullId'] for loco in response.get_json()['locos']]
+    assert fleetLoco.fullNumber in fullIds
+    assert otherId not in fullIds
@@ -0,0 +1,48 @@
+import logging
+import pytest
+from isorClient import IsorClient
+from isorDataTypes import IsorRequest
+
+@pytest.fixture
+def isorClient(fakeIsor):
+    ## no RequestHandler thread, the tests take the queued requests themselves
+    return IsorClient(logging.getLogger("test"), "username", "password", baseUrl=fakeIsor.baseUrl)
+
+def trainRequest(isorClient : IsorClient) -> IsorRequest:
+    return IsorRequest(f"{isorClient.baseUrl}/Dotazy/D2040", { 'cisloVlaku' : "141" })
+
+def test_submitAfterAbandonedRequestIsDroppedGetsItsOwnRequest(isorClient):
+    abandoned = isorClient.Submit(trainRequest(isorClient))
+    abandoned.cancel()
+    queued = isorClient.requestQueue.get()
+
+    assert isorClient.dropIfAbandoned(queued)
+
+    ## the new caller is not attached to the dropped request, it is queued on its own
+    future = isorClient.Submit(trainRequest(isorClient))
+    assert isorClient.coalescedCount == 0
+    assert isorClient.requestQueue.qsize() == 1
+    assert not future.done()
+
+def test_submitCoalescedBeforeTheCheckKeepsTheRequest(isorClient):
+    abandoned = isorClient.Submit(trainRequest(isorClient))
+    abandoned.cancel()
+    queued = isorClient.requestQueue.get()
+
+    future = isorClient.Submit(trainRequest(isorClient))
+    assert isorClient.coalescedCount == 1
+
+    assert not isorClient.dropIfAbandoned(queued)
+
+    response = isorClient.sendRequest(queued)
+    isorClient.finishInFlight(queued, response)
+    assert future.result(timeout=5) is response
+
+def test_followersNeverGetAMissingResponse(isorClient):
+    future = isorClient.Submit(trainRequest(isorClient))
+    queued = isorClient.requestQueue.get()
+
+    isorClient.finishInFlight(queued)
+
+    with pytest.raises(Exception):
+        future.result(timeout=5)
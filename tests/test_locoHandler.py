@@ -0,0 +1,42 @@
+import os
+import logging
+from locoHandler import LocoListHandler
+
+rootPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+def createHandler(tmp_path, lines : list[str]) -> LocoListHandler:
+    configPath = tmp_path / "locoList.csv"
+    configPath.write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+    return LocoListHandler(str(configPath), os.path.join(rootPath, "data", "lokomotivy.json"), logging.getLogger("test"))
+
+def test_deletingOneOfTwoLocosWithTheSameShortNumber(tmp_path):
+    handler = createHandler(tmp_path, ["749121;925427491210;;;", "749121;915447491210;;;"])
+
+    handler.removeLoco(handler.getLocoByFullNumber("915447491210"))
+
+    assert handler.getLocoByFullNumber("915447491210") is None
+    assert handler.getLoco("749121").fullNumber == "925427491210"
+    assert [loco.fullNumber for loco in handler.locosByNumber["749121"]] == ["925427491210"]
+    assert [loco.fullNumber for loco in handler.locoList] == ["925427491210"]
+
+    ## the file holds only the remaining loco as well
+    assert [loco.fullNumber for loco in handler.deserialize()] == ["925427491210"]
+
+def test_deletingTheLastLocoWithAShortNumber(tmp_path):
+    handler = createHandler(tmp_path, ["749121;925427491210;;;"])
+
+    handler.removeLoco(handler.getLocoByFullNumber("925427491210"))
+
+    assert "749121" not in handler.locosByNumber
+    assert handler.getLoco("749121").fullNumber == "749121" ## a temporary loco now
+
+def test_reloadingAnEmptyListEmptiesTheFleet(tmp_path):
+    handler = createHandler(tmp_path, ["749121;925427491210;;;"])
+    assert len(handler.locoList) == 1
+    version = handler.version
+
+    (tmp_path / "locoList.csv").write_text("", encoding="utf-8")
+    handler.deserialize()
+
+    assert handler.locoList == []
+    assert handler.version > version
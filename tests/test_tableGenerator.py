@@ -0,0 +1,31 @@
+from tableGenerator import TableGenerator
+from locoHandler import Loco, LocoExportModel
+
+def exportModel(place : str, fetchedAt : float) -> LocoExportModel:
+    return LocoExportModel("749.121", "925427491210", None, "1. vlakové HV", "141", "---", place, "18.10.2026 16:22", fetchedAt)
+
+def test_failedResultKeepsThePreviousRow(tmp_path):
+    generator = TableGenerator(str(tmp_path / "output.html"))
+    loco = Loco("749121", "925427491210", "", "")
+
+    assert generator.storeResult(exportModel("Praha hl.n.", 1000.0))
+    assert not generator.storeResult(exportModel("", None))
+
+    assert [row.place for row in generator.collectResults([loco])] == ["Praha hl.n."]
+
+def test_failedResultOfANewLocoIsShown(tmp_path):
+    generator = TableGenerator(str(tmp_path / "output.html"))
+    loco = Loco("749121", "925427491210", "", "")
+
+    assert generator.storeResult(exportModel("", None))
+    assert len(generator.collectResults([loco])) == 1
+
+def test_updateWithoutAPageRendersTheWholePage(tmp_path):
+    generator = TableGenerator(str(tmp_path / "output.html"))
+    assert generator.outputSnapshot.current() is None
+
+    generator.updateIndexTable(exportModel("Praha hl.n.", 1000.0))
+
+    page = generator.outputSnapshot.current().html
+    assert "<table" in page and "749.121" in page
+    assert (tmp_path / "output.html").read_text(encoding="utf-8") == page
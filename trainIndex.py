@@ -0,0 +1,64 @@
+import threading
+from locoHandler import LocoExportModel
+from keyIndex import KeyIndex, normalizeTrain, normalizeStation
+
+class TrainIndex:
+    ## Reverse index of the latest dump results: train number and station to the locos on them.
+    ## Every result replaces the previous entries of its loco, so an update and a lookup are O(1).
+    def __init__(self):
+        self.byTrain = KeyIndex(normalizeTrain) ## train number to the full ids of the locos hauling it
+        self.byReservation = KeyIndex(normalizeTrain) ## train number to the full ids of the locos reserved for it
+        self.byStation = KeyIndex(normalizeStation) ## station without the +/- sign to full ids
+        self.results : dict[str, LocoExportModel] = {} ## full id to its latest result
+        self.version = 0 ## raised on every change, tells readers whether anything is new
+        self.lock = threading.Lock()
+
+    def update(self, exportModel : LocoExportModel):
+        with self.lock:
+            previous = self.results.get(exportModel.fullId)
+            if previous is not None:
+                self.unlink(previous)
+
+            self.results[exportModel.fullId] = exportModel
+            self.version += 1
+            self.link(exportModel)
+
+    def remove(self, fullId : str):
+        with self.lock:
+            previous = self.results.pop(fullId, None)
+            if previous is not None:
+                self.version += 1
+                self.unlink(previous)
+
+    def getLocosOnTrain(self, train : str) -> tuple[list[LocoExportModel], list[LocoExportModel]]:
+        ## (hauling the train, reserved for it)
+        with self.lock:
+            return self.lookup(self.byTrain, train), self.lookup(self.byReservation, train)
+
+    def getLocosAtStation(self, station : str) -> list[LocoExportModel]:
+        with self.lock:
+            return self.lookup(self.byStation, station)
+
+    def getResults(self, station : str = None) -> tuple[int, list[LocoExportModel]]:
+        ## (version, results) of all locos or only of those at the station
+        with self.lock:
+            if station is not None:
+                return self.version, self.lookup(self.byStation, station)
+            return self.version, list(self.results.values())
+
+    def lookup(self, index : KeyIndex, value : str) -> list[LocoExportModel]:
+        return [self.results[fullId] for fullId in index.get(value)]
+
+    def link(self, exportModel : LocoExportModel):
+        self.byTrain.add(exportModel.trainNum, exportModel.fullId)
+        self.byReservation.add(exportModel.trainNumReservation, exportModel.fullId)
+        self.byStation.add(exportModel.place, exportModel.fullId)
+
+    def unlink(self, exportModel : LocoExportModel):
+        self.byTrain.remove(exportModel.trainNum, exportModel.fullId)
+        self.byReservation.remove(exportModel.trainNumReservation, exportModel.fullId)
+        self.byStation.remove(exportModel.place, exportModel.fullId)
+
+    def getStats(self) -> dict:
+        with self.lock:
+            return { 'locos' : len(self.results), 'trains' : len(self.byTrain), 'reservations' : len(self.byReservation), 'stations' : len(self.byStation) }